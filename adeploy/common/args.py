@@ -74,6 +74,29 @@ def setup_parser():
     parser.add_argument('--recreate-secrets', dest='recreate_secrets', action='store_true',
                         help='Force to re-create secrets. This might invoke a password store to retrieve secrets.')
 
+    parser.add_argument('--sync-secrets', dest='sync_secrets', action='store_true',
+                        help='Re-create only existing secrets whose content has changed. This compares a content hash '
+                             'with the hash annotated at the deployed secret and might invoke a password store to '
+                             'retrieve secrets.')
+
+    parser.add_argument('--secrets-cache', dest='secrets_cache', action='store_true',
+                        help='Cache secret values from Gopass and shell commands encrypted in the adeploy dir. '
+                             'Requires the "cryptography" package and a key in the env var ADEPLOY_SECRETS_CACHE_KEY '
+                             'or the "keyring" package to store the key in the OS keyring.')
+
+    parser.add_argument('--secrets-cache-ttl', dest='secrets_cache_ttl', type=int, default=3600,
+                        help='Time in seconds until cached secret values expire. Default is 3600.')
+
+    parser.add_argument('--purge-secrets-cache', dest='purge_secrets_cache', action='store_true',
+                        help='Remove all cached secret values.')
+
+    parser.add_argument('--no-config-cache', dest='no_config_cache', action='store_true',
+                        help='Always evaluate the namespace/release configurations instead of using the configurations '
+                             'stored by the render step.')
+
+    parser.add_argument('--offline', dest='offline', action='store_true',
+                        help='Do not download files included by URL but use the cached files from the adeploy dir.')
+
     parser.add_argument('--filter-namespace', dest='filters_namespace', nargs='+', action='append',
                         help='Only include specified namespace. Argument can be specified multiple times.')
 
@@ -99,6 +122,11 @@ def setup_parser():
         subparser = subparsers.add_parser(module_name,
                                           help=f'Call module "{module_name}", '
                                                f'type: {sys.argv[0]} {module_name} --help for more options')
+        if module_name == 'pipeline':
+            subparser.add_argument("pipeline_stages", metavar='steps',
+                                   help="Comma separated build steps to run in a single process, i.e. "
+                                        "\"render,test,deploy\".")
+
         subparser.add_argument("src_dirs",
                                help="Directory containing deployment sources",
                                nargs='*', default='.', metavar='src_dir')
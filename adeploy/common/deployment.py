@@ -1,8 +1,11 @@
 import copy
+import hashlib
+import json
 import os
 import shutil
 from logging import Logger
 from pathlib import Path
+from typing import List, Optional
 
 import yaml
 from yaml.parser import ParserError
@@ -19,13 +22,18 @@ class Deployment:
     release: str
     namespace: str
     config: dict
+    config_path: Path = None
+    dependencies: jinja_env.Dependencies = None
     hooks: dict
 
+    _config_cache_version = 2
+
     def __init__(self, name: str, release: str, namespace: str, build_dir: str):
         self.name = name
         self.release = release
         self.namespace = namespace
         self.hooks = {}
+        self.dependencies = jinja_env.Dependencies()
 
         self.build_dir = Path(build_dir)
 
@@ -40,6 +48,12 @@ class Deployment:
             .joinpath(self.name) \
             .joinpath(self.release)
 
+        self.config_cache_file = Path(build_dir) \
+            .joinpath('.configs') \
+            .joinpath(self.namespace) \
+            .joinpath(self.name) \
+            .joinpath(f'{self.release}.json')
+
     def __repr__(self):
         return f'{self.namespace}/{self.name}-{self.release}'
 
@@ -62,6 +76,8 @@ class Deployment:
                 log.info(f'Using defaults from "{colors.bold(defaults_file)}" ...')
 
         self.config = {}
+        self.config_path = config_path
+        self.dependencies = jinja_env.Dependencies()
 
         if defaults_file:
 
@@ -70,7 +86,8 @@ class Deployment:
                 # Compile defaults with default Jinja renderer i.e. to provide globals and filters
                 defaults = get_defaults(defaults_file,
                                         deployment=self, log=log,
-                                        template_values=self.get_template_values())
+                                        template_values=self.get_template_values(),
+                                        dependencies=self.dependencies)
                 if defaults is not None:
                     self.config.update(defaults)
 
@@ -80,7 +97,10 @@ class Deployment:
         try:
             # Compile config with default Jinja renderer i.e. to provide globals and filters
             env = jinja_env.create([config_path.parent], deployment=self, log=log)
-            template = env.get_template(config_path.name).render(defaults=self.config, **self.get_template_values())
+            with env.record_dependencies() as dependencies:
+                template = env.get_template(config_path.name).render(defaults=self.config,
+                                                                     **self.get_template_values())
+            self.dependencies.update(dependencies)
             self.config = dict_update_recursive(self.config, yaml.load(template, Loader=yaml.FullLoader))
 
         except ScannerError as e:
@@ -93,6 +113,71 @@ class Deployment:
 
         return self.config
 
+    @staticmethod
+    def get_config_fingerprint(config_path: Path, defaults_file: Optional[Path], dependencies: List[str]) -> str:
+        files = {}
+        for path in sorted(dependencies):
+            try:
+                stat = os.stat(path)
+                files[path] = [stat.st_mtime_ns, stat.st_size]
+            except OSError:
+                files[path] = None
+
+        return hashlib.sha256(json.dumps({
+            'config': os.path.realpath(config_path),
+            'defaults': os.path.realpath(defaults_file) if defaults_file else None,
+            'files': files,
+            'include_basedir': os.getenv('ADEPLOY_EXTERNAL_INCLUDE_BASEDIR'),
+        }, sort_keys=True).encode()).hexdigest()
+
+    def store_config(self, defaults_file: Path = None, log: Logger = None):
+        """
+        Store the evaluated config in the build dir, so that subsequent steps do not need to evaluate it again.
+        Configs using secrets or other inputs than files are not stored, see jinja.env.Dependencies.
+        """
+        if self.dependencies.volatile:
+            log and log.debug(f'... not caching config of deployment "{colors.blue(self)}", it uses '
+                              f'{", ".join(sorted(self.dependencies.volatile))}')
+            self.config_cache_file.unlink(missing_ok=True)
+            return
+
+        dependencies = sorted(set([os.path.realpath(self.config_path)]) | self.dependencies)
+        try:
+            data = json.dumps({
+                'version': self._config_cache_version,
+                'fingerprint': self.get_config_fingerprint(self.config_path, defaults_file, dependencies),
+                'dependencies': dependencies,
+                'config': self.config,
+            })
+        except (TypeError, ValueError) as e:
+            log and log.debug(f'... cannot cache config of deployment "{colors.blue(self)}": {e}')
+            return
+
+        self.config_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.config_cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_text(data)
+        os.replace(tmp, self.config_cache_file)
+
+    def load_cached_config(self, config_path: Path, defaults_file: Path = None, log: Logger = None) -> bool:
+        """
+        Load the config stored by a previous step if the config, the defaults and the files they use are unchanged.
+        """
+        try:
+            with open(self.config_cache_file, 'r') as fd:
+                entry = json.load(fd)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        if entry.get('version') != self._config_cache_version or entry.get('fingerprint') != \
+                self.get_config_fingerprint(config_path, defaults_file, entry.get('dependencies', [])):
+            return False
+
+        log and log.debug(f'Using cached config from "{colors.bold(self.config_cache_file)}" ...')
+        self.config = entry.get('config')
+        self.config_path = config_path
+        self.dependencies = jinja_env.Dependencies(entry.get('dependencies'))
+        return True
+
     def get_template_values(self):
 
         values = copy.deepcopy(self.config)
@@ -121,10 +206,9 @@ class Deployment:
             with open(self.last_cluster_file, 'w') as f:
                 f.write(cluster)
 
-    def clean_build_dir(self):
+    def clean_build_dir(self, keep_manifests: bool = False):
 
-        dirs_to_remove = [
-            self.manifests_dir,  # Contains the rendered manifests
+        dirs_to_remove = ([] if keep_manifests else [self.manifests_dir]) + [  # Contains the rendered manifests
             self.build_dir / self.name,  # Contains secrets
         ]
 
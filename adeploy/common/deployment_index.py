@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+from logging import Logger
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from adeploy.common import colors
+
+
+class DeploymentIndex:
+    """
+    An index of the deployment configs found in the namespaces dir, see Provider.load_deployments().
+    The index is cached in the adeploy dir together with the mtimes of the scanned dirs. As adding, removing or renaming
+    files changes the mtime of a dir, only dirs with a changed mtime are scanned again.
+    """
+    VERSION = 1
+
+    # Dirs modified within this time are scanned again on the next run, as further changes may not change the mtime
+    RACY_NS = 2 * 10 ** 9
+
+    @staticmethod
+    def get_index_file(namespaces_dir: Path, name: str) -> Path:
+        from adeploy.common.args import get_args
+        key = hashlib.sha256(f'{os.path.realpath(namespaces_dir)}\0{name}'.encode()).hexdigest()
+        return Path(get_args().adeploy_dir).joinpath('deployments').joinpath(f'{key}.json')
+
+    @classmethod
+    def get_mtime(cls, path: str or Path) -> Optional[int]:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        return mtime if time.time_ns() - mtime > cls.RACY_NS else None
+
+    @classmethod
+    def get_dirs(cls, namespaces_dir: Path, ns: str, name: str) -> dict:
+        # Structure 1: namespaces / <namespace_name> / <deployment_release>.yml
+        # Structure 2: namespaces / <namespace_name> / <deployment_name> / <deployment_release>.yml
+        dirs = {ns: cls.get_mtime(namespaces_dir.joinpath(ns))}
+        if namespaces_dir.joinpath(ns).joinpath(name).is_dir():
+            dirs[os.path.join(ns, name)] = cls.get_mtime(namespaces_dir.joinpath(ns).joinpath(name))
+        return dirs
+
+    @staticmethod
+    def scan(namespaces_dir: Path, deployment_dir: str, extensions: List[str]) -> List[list]:
+        configs = []
+        with os.scandir(namespaces_dir.joinpath(deployment_dir)) as entries:
+            for entry in entries:
+                if entry.name[0] != '.' and entry.name.rsplit('.', 1)[-1] in extensions and entry.is_file():
+                    configs.append([os.path.join(deployment_dir, entry.name), entry.stat().st_mtime_ns])
+
+        # Keep the order of the extensions as in previous versions
+        return sorted(configs, key=lambda c: (extensions.index(c[0].rsplit('.', 1)[-1]), c[0]))
+
+    @classmethod
+    def load(cls, log: Logger, namespaces_dir: Path, name: str, extensions: List[str]) -> List[Tuple[str, Path]]:
+        """
+        Return the namespace and the config path of all deployments in the namespaces dir.
+        """
+        index_file = cls.get_index_file(namespaces_dir, name)
+        try:
+            with open(index_file, 'r') as fd:
+                index = json.load(fd)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+
+        if index.get('version') != cls.VERSION or index.get('extensions') != extensions:
+            index = {}
+
+        cached_namespaces = index.get('namespaces', {})
+        mtime = cls.get_mtime(namespaces_dir)
+        if mtime is not None and index.get('mtime') == mtime:
+            names = list(cached_namespaces.keys())
+        else:
+            with os.scandir(namespaces_dir) as entries:
+                names = sorted([e.name for e in entries if e.is_dir()])
+
+        namespaces = {}
+        for ns in names:
+            dirs = cls.get_dirs(namespaces_dir, ns, name)
+            cached = cached_namespaces.get(ns)
+            if cached and None not in dirs.values() and cached.get('dirs') == dirs:
+                namespaces[ns] = cached
+                continue
+
+            log.debug(f'Scanning for deployment configs in "{colors.bold(namespaces_dir.joinpath(ns))}" ...')
+            deployment_dir = os.path.join(ns, name) if len(dirs) > 1 else ns
+            namespaces[ns] = {'dirs': dirs, 'configs': cls.scan(namespaces_dir, deployment_dir, extensions)}
+
+        if namespaces != cached_namespaces or mtime != index.get('mtime'):
+            cls.save(log, index_file, {
+                'version': cls.VERSION,
+                'extensions': extensions,
+                'mtime': mtime,
+                'namespaces': namespaces,
+            })
+
+        return [(ns, namespaces_dir.joinpath(config)) for ns, n in namespaces.items() for config, _ in n['configs']]
+
+    @staticmethod
+    def save(log: Logger, index_file: Path, index: dict):
+        try:
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = index_file.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, 'w') as fd:
+                json.dump(index, fd)
+            os.replace(tmp, index_file)
+        except OSError as e:
+            log.debug(f'... cannot write deployment index "{colors.bold(index_file)}": {e}')
@@ -1,4 +1,7 @@
 import collections.abc
+import copy
+import hashlib
+import json
 import os
 import sys
 import pkgutil
@@ -43,14 +46,59 @@ def get_providers() -> dict:
     return found
 
 
-def get_defaults(defaults_file, deployment=None, log=None, template_values=None):
-    env = jinja_env.create([defaults_file.parent], deployment=deployment, log=log)
+# Evaluated defaults by file path, mtime and template values, see get_defaults()
+_defaults_cache = {}
+
+
+def get_file_stats(paths) -> dict:
+    # The mtime and size of the given files to detect changes, None if a file does not exist
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stats[path] = None
+    return stats
+
+
+def get_defaults(defaults_file, deployment=None, log=None, template_values=None, dependencies: set = None):
     # Make best to load defaults
     template_values_default = {
         'name': deployment.name if deployment else 'undefined',
         'namespace': deployment.namespace if deployment else 'undefined',
     }
-    return yaml.load(env.get_template(defaults_file.name).render(template_values if template_values else template_values_default), Loader=yaml.FullLoader)
+    values = template_values if template_values else template_values_default
+
+    # Evaluate the defaults only once per file version and deployment context. Note that secrets created in the
+    # defaults are registered on the first evaluation and the registry is kept for the whole run.
+    key = None
+    try:
+        stat = os.stat(defaults_file)
+        key = (os.path.realpath(defaults_file), stat.st_mtime_ns, stat.st_size, repr(deployment),
+               json.dumps(values, sort_keys=True, default=str))
+        # Files included by the defaults must be unchanged as well
+        if key in _defaults_cache and \
+                get_file_stats(_defaults_cache[key][2].keys()) == _defaults_cache[key][2]:
+            defaults, defaults_dependencies, _ = _defaults_cache[key]
+            if dependencies is not None:
+                dependencies.update(defaults_dependencies)
+            return copy.deepcopy(defaults)
+    except (OSError, TypeError):
+        pass
+
+    env = jinja_env.create([defaults_file.parent], deployment=deployment, log=log)
+    with env.record_dependencies() as defaults_dependencies:
+        defaults = yaml.load(env.get_template(defaults_file.name).render(values), Loader=yaml.FullLoader)
+
+    if dependencies is not None:
+        dependencies.update(defaults_dependencies)
+
+    if key:
+        _defaults_cache[key] = (defaults, defaults_dependencies, get_file_stats(defaults_dependencies))
+        return copy.deepcopy(defaults)
+
+    return defaults
 
 
 def run_command(log, cmd) -> subprocess.CompletedProcess:
@@ -75,4 +123,37 @@ def dict_update_recursive(d: dict, u: dict) -> dict:
             #    d[k] = (d[k] if k in d else []) + v
             else:
                 d[k] = v
-    return d
\ No newline at end of file
+    return d
+
+
+def get_dir_digest(path, exclude: list = None) -> str:
+    # Digest of all relative file paths and file contents in the given dir
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(str(path)):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            rel_path = os.path.relpath(file_path, str(path))
+            if exclude and rel_path in exclude:
+                continue
+            digest.update(rel_path.encode())
+            digest.update(b'\0')
+            with open(file_path, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(65536), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_file_digests(path) -> dict:
+    # Digests of all files in the given dir by relative file path
+    digests = {}
+    for root, dirs, files in os.walk(str(path)):
+        for name in files:
+            file_path = os.path.join(root, name)
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(65536), b''):
+                    digest.update(chunk)
+            digests[os.path.relpath(file_path, str(path))] = digest.hexdigest()
+    return digests
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from logging import Logger
+from pathlib import Path
+from typing import Dict, Optional
+
+from adeploy.common import colors
+from adeploy.common.errors import RenderError
+
+
+class HttpCache:
+    """
+    An on-disk cache for files included by URL, stored in the adeploy dir.
+    Cached files are revalidated once per run using conditional requests i.e. ETag and Last-Modified. Files pinned by a
+    SHA256 checksum are never revalidated. Using --offline, only cached files are used.
+    """
+    TIMEOUT = 30
+
+    __contents: Dict[str, bytes] = {}
+    __locks: Dict[str, threading.Lock] = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_dir() -> Path:
+        from adeploy.common.args import get_args
+        return Path(get_args().adeploy_dir).joinpath('http-cache')
+
+    @staticmethod
+    def is_offline() -> bool:
+        from adeploy.common.args import get_args
+        return getattr(get_args(), 'offline', False)
+
+    @staticmethod
+    def get_path(url: str) -> Path:
+        return HttpCache.get_cache_dir().joinpath(hashlib.sha256(url.encode()).hexdigest())
+
+    @staticmethod
+    def read(url: str) -> (Optional[dict], Optional[bytes]):
+        path = HttpCache.get_path(url)
+        try:
+            with open(path.joinpath('meta.json'), 'r') as fd:
+                meta = json.load(fd)
+            content = path.joinpath('content').read_bytes()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+
+        # Ignore incomplete or corrupted entries
+        if hashlib.sha256(content).hexdigest() != meta.get('sha256'):
+            return None, None
+
+        return meta, content
+
+    @staticmethod
+    def write(url: str, content: bytes, etag: str = None, last_modified: str = None):
+        path = HttpCache.get_path(url)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, data in [('content', content), ('meta.json', json.dumps({
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'sha256': hashlib.sha256(content).hexdigest(),
+        }).encode())]:
+            tmp = path.joinpath(f'.{name}.{os.getpid()}.{threading.get_ident()}')
+            tmp.write_bytes(data)
+            os.replace(tmp, path.joinpath(name))
+
+    @classmethod
+    def get(cls, url: str, log: Logger, sha256: str = None) -> bytes:
+        """
+        Return the content of the URL from the cache or download it. If sha256 is given, the content must match.
+        """
+        with cls.__lock:
+            lock = cls.__locks.setdefault(url, threading.Lock())
+
+        # Concurrent requests for the same URL wait for the first one
+        with lock:
+            content = cls.__contents.get(url)
+            if content is None:
+                content = cls.fetch(url, log, sha256)
+                cls.__contents[url] = content
+
+        cls.verify(url, content, sha256)
+        return content
+
+    @classmethod
+    def verify(cls, url: str, content: bytes, sha256: str = None):
+        if sha256 and hashlib.sha256(content).hexdigest() != sha256.lower():
+            raise RenderError(f'Checksum mismatch for "{colors.bold(url)}", expected SHA256 {colors.bold(sha256)} '
+                              f'but got {colors.bold(hashlib.sha256(content).hexdigest())}')
+
+    @classmethod
+    def fetch(cls, url: str, log: Logger, sha256: str = None) -> bytes:
+        meta, content = cls.read(url)
+
+        # Pinned content never changes, so there is no need to revalidate
+        if content is not None and sha256 and meta.get('sha256') == sha256.lower():
+            log and log.debug(f'... using pinned "{colors.bold(url)}" from cache')
+            return content
+
+        if cls.is_offline():
+            if content is None:
+                raise RenderError(f'Cannot include "{colors.bold(url)}" in offline mode, file is not cached.')
+            log and log.debug(f'... using "{colors.bold(url)}" from cache in offline mode')
+            return content
+
+        # Cached content not matching the pin is downloaded again instead of being revalidated
+        if content is not None and sha256:
+            meta, content = {}, None
+
+        request = urllib.request.Request(url)
+        if content is not None and meta.get('etag'):
+            request.add_header('If-None-Match', meta.get('etag'))
+        if content is not None and meta.get('last_modified'):
+            request.add_header('If-Modified-Since', meta.get('last_modified'))
+
+        log and log.debug(f'Downloading "{colors.bold(url)}" ...')
+        try:
+            with urllib.request.urlopen(request, timeout=cls.TIMEOUT) as response:
+                data = response.read()
+                # Content not matching the pin is never cached
+                cls.verify(url, data, sha256)
+                cls.write(url, data, etag=response.headers.get('ETag'),
+                          last_modified=response.headers.get('Last-Modified'))
+                return data
+
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and content is not None:
+                log and log.debug(f'... "{colors.bold(url)}" not modified, using cache')
+                return content
+            error = e
+
+        except (urllib.error.URLError, OSError) as e:
+            error = e
+
+        if content is not None:
+            log and log.warning(f'Cannot download "{colors.bold(url)}", using cached file: {error}')
+            return content
+
+        raise RenderError(f'Cannot download "{colors.bold(url)}": {error}')
@@ -1,5 +1,10 @@
+import copy
 import re
 
+import yaml
+
+from adeploy.common.errors import RenderError
+
 
 class JinjaDict(dict):
 
@@ -41,4 +46,57 @@ class JinjaDict(dict):
         obj = {}
         for n, v in self.items():
             obj[n] = v
-        return obj
\ No newline at end of file
+        return obj
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict shared by several callers i.e. a document parsed once by from_json_or_yaml(). It is rendered and dumped
+    like a dict but cannot be modified, copy() and copy.deepcopy() return a modifiable copy.
+    """
+
+    def read_only(self, *args, **kwargs):
+        raise RenderError('The data is read-only, use copy() to get a modifiable copy')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = read_only
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+
+class ReadOnlyList(list):
+    """
+    A list shared by several callers, see ReadOnlyDict.
+    """
+
+    def read_only(self, *args, **kwargs):
+        raise RenderError('The data is read-only, use copy() to get a modifiable copy')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = reverse = \
+        sort = read_only
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+
+def read_only(data):
+    """
+    Convert the dicts and lists of the given data into ReadOnlyDict and ReadOnlyList.
+    """
+    if isinstance(data, dict):
+        return ReadOnlyDict({k: read_only(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return ReadOnlyList([read_only(v) for v in data])
+    return data
+
+
+# Dump read-only data like dicts and lists i.e. using the yaml() filter
+for dumper in [yaml.SafeDumper, yaml.Dumper]:
+    dumper.add_representer(ReadOnlyDict, yaml.representer.SafeRepresenter.represent_dict)
+    dumper.add_representer(ReadOnlyList, yaml.representer.SafeRepresenter.represent_list)
@@ -1,3 +1,5 @@
+import os
+from contextlib import contextmanager
 from inspect import getmembers, isfunction, ismethod, getfile
 from logging import Logger
 from pathlib import Path
@@ -9,11 +11,118 @@ import adeploy.common.jinja.globals as globals
 import adeploy.common.jinja.filters as filters
 
 
+class IncludeLoader(jinja2.FileSystemLoader):
+    """
+    File system loader with a fixed search path. Resolved paths and sources are cached, the sources by mtime, so that
+    repeated lookups i.e. by include_file() and list_dir() for each deployment do not scan the search path again.
+    The search path is only extended explicitly using add_searchpath().
+    """
+
+    def __init__(self, searchpath: List[str or Path], encoding: str = 'utf-8', followlinks: bool = False):
+        super().__init__(searchpath, encoding, followlinks)
+        self.searchpath = tuple(self.searchpath)
+        self.resolved = {}
+        self.sources = {}
+
+    def add_searchpath(self, path: str or Path):
+        path = os.fspath(path)
+        if path not in self.searchpath:
+            self.searchpath = self.searchpath + (path,)
+            self.resolved = {}
+
+    def clear_cache(self):
+        # Files may have been added to the search path that take precedence over resolved paths
+        self.resolved = {}
+        self.sources = {}
+
+    def get_source(self, environment: jinja2.Environment, template: str):
+        filename = self.resolved.get(template)
+        try:
+            mtime = os.path.getmtime(filename) if filename else None
+        except OSError:
+            mtime = None
+
+        if mtime is None:
+            source, filename, _ = super().get_source(environment, template)
+            mtime = os.path.getmtime(filename)
+            self.resolved[template] = filename
+            self.sources[filename] = (mtime, source)
+
+        cached_mtime, source = self.sources.get(filename, (None, None))
+        if cached_mtime != mtime:
+            with open(filename, encoding=self.encoding) as fd:
+                source = fd.read()
+            self.sources[filename] = (mtime, source)
+
+        def uptodate() -> bool:
+            try:
+                return os.path.getmtime(filename) == mtime
+            except OSError:
+                return False
+
+        return source, filename, uptodate
+
+
+class Dependencies(set):
+    """
+    The files used while rendering. Inputs that are not files i.e. secrets, URLs or random values are recorded by name
+    in `volatile`, a result using them cannot be reused based on the files only.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.volatile = set()
+
+    def update(self, *others):
+        super().update(*others)
+        for other in others:
+            self.volatile.update(getattr(other, 'volatile', set()))
+
+
+class Environment(jinja2.Environment):
+    """
+    Jinja environment that records the files used while rendering i.e. templates, imports, includes and files read by
+    global functions. See record_dependencies().
+    """
+
+    dependencies: Dependencies = None
+
+    def get_template(self, name, parent=None, globals=None) -> jinja2.Template:
+        template = super().get_template(name, parent, globals)
+        self.add_dependency(template.filename)
+        return template
+
+    def select_template(self, names, parent=None, globals=None) -> jinja2.Template:
+        template = super().select_template(names, parent, globals)
+        self.add_dependency(template.filename)
+        return template
+
+    def add_dependency(self, path: str or Path):
+        if self.dependencies is not None and path:
+            self.dependencies.add(os.path.realpath(path))
+
+    def add_volatile(self, name: str):
+        if self.dependencies is not None:
+            self.dependencies.volatile.add(name)
+
+    @contextmanager
+    def record_dependencies(self) -> Dependencies:
+        dependencies = self.dependencies
+        self.dependencies = Dependencies()
+        try:
+            yield self.dependencies
+        finally:
+            # Nested recordings are added to the outer recording
+            if dependencies is not None:
+                dependencies.update(self.dependencies)
+            self.dependencies = dependencies
+
+
 def create(pathes: List[str or Path] = None, log: Logger = None, deployment=None,
-           templates_dir=None) -> jinja2.Environment:
-    env = jinja2.Environment(
+           templates_dir=None) -> Environment:
+    env = Environment(
         # This is to load macros from template dir and the parent dir
-        loader=jinja2.FileSystemLoader([str(p) for p in pathes]),
+        loader=IncludeLoader([str(p) for p in pathes]),
         autoescape=jinja2.select_autoescape(['json']),
         # Add support for expressions statements, see https://stackoverflow.com/a/39858522/381166
         extensions=['jinja2.ext.do'],
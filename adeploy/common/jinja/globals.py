@@ -2,6 +2,7 @@
 The following functions are globally available in the `default.yml`, the namespace/release configuration or
 in the Jinja templates in your `templates` folder.
 """
+import functools
 import os
 import pathlib
 import sys
@@ -11,18 +12,26 @@ import jq
 import string
 import json
 import textwrap
-import urllib.request
 import jinja2
 
+from collections import OrderedDict
 from logging import Logger
 from typing import Dict, List, Literal, Union
 from ruamel.yaml import YAML
 
 import adeploy.common.colors as colors
+import adeploy.common.jinja.dict as jinja_dict
 import adeploy.common.secrets as secret
 import adeploy.common.errors as errors
+from adeploy.common.http_cache import HttpCache
 from adeploy.common.secrets_provider.provider import SecretsProvider
 
+# The recently parsed files by path, version and type and compiled jq programs by query, see
+# Handler.from_json_or_yaml(). Both are bounded as they are kept for the whole run i.e. while watching.
+_documents = OrderedDict()
+_documents_size = 32
+_jq_compile = functools.lru_cache(maxsize=256)(jq.compile)
+
 
 class Handler(object):
     named_passwords = {}
@@ -53,7 +62,8 @@ class Handler(object):
 
         Returns:
             data:   The content of the file or loaded by json.loads() or yaml.load().
-                    If a jq_query is given it is applied.
+                    If a jq_query is given it is applied. Without a jq_query, the data is read-only, use `copy()` to
+                    modify it i.e. `{% set data = from_json_or_yaml('data.yml').copy() %}`.
 
         !!!Example
             ```{.jinja hl_lines="4"}
@@ -69,6 +79,10 @@ class Handler(object):
             [jq manual](https://jqlang.github.io/jq/manual/) for details.
 
         """
+        if '$' in path:
+            # The result depends on env vars
+            self.env.add_volatile('from_json_or_yaml()')
+
         path = os.path.expandvars(path)
         # Check if ADEPLOY_EXTERNAL_INCLUDE_BASEDIR is set and build the alternate path
         external_base_dir = os.getenv('ADEPLOY_EXTERNAL_INCLUDE_BASEDIR')
@@ -85,6 +99,7 @@ class Handler(object):
             sys.exit(1)
 
         self.log.debug(f'Importing from: {path}' + f' with query: {jq_query} ' if jq_query else 'without query')
+        self.env.add_dependency(path)
 
         if force_type:
             file_extension = force_type
@@ -94,23 +109,38 @@ class Handler(object):
             self.log.error(f"Unsupported file extension: {file_extension}. Supported extensions are: .json, .yaml, .yml")
             sys.exit(1)
 
-        # Load the file based on its extension
-        with open(path, 'r') as f:
-            if file_extension in ['.json']:
-                data = json.load(f)
-            elif file_extension in ['.yaml', '.yml']:
-                yaml = YAML(typ='safe', pure=True)
-                # Add a custom constructor for !vault tags (ansible-vault)
-                yaml.constructor.add_constructor('!vault', lambda loader, node: loader.construct_scalar(node))
-                data = yaml.load(f)
-
-        # If no query is provided, return the entire content of the file
+        # Load the file based on its extension. Files are parsed only once per version, as the same files are usually
+        # imported for each deployment.
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size, file_extension)
+        if key not in _documents:
+            with open(path, 'r') as f:
+                if file_extension in ['.json']:
+                    data = json.load(f)
+                elif file_extension in ['.yaml', '.yml']:
+                    # Uses the C based loader from ruamel.yaml.clib if available
+                    yaml = YAML(typ='safe')
+                    # Add a custom constructor for !vault tags (ansible-vault)
+                    yaml.constructor.add_constructor('!vault', lambda loader, node: loader.construct_scalar(node))
+                    data = yaml.load(f)
+
+            for outdated in [k for k in _documents.keys() if k[0] == key[0]]:
+                del _documents[outdated]
+            _documents[key] = jinja_dict.read_only(data)
+            while len(_documents) > _documents_size:
+                _documents.popitem(last=False)
+
+        _documents.move_to_end(key)
+        data = _documents[key]
+
+        # If no query is provided, return the entire content of the file. The parsed file is shared by all callers,
+        # so it is read-only.
         if not jq_query:
             return data
 
         # Apply jq-like query to the data
         try:
-            results = jq.all(jq_query, data)  # Get all matches
+            results = _jq_compile(jq_query).input_value(data).all()  # Get all matches
         except Exception as e:
             self.log.error(f"Error applying query: {jq_query}. Error: {e}")
             sys.exit(1)
@@ -146,6 +176,7 @@ class Handler(object):
                 labels: {{ job.labels }}
             ```
         """
+        self.env.add_volatile('uuid()')
         return str(uuid.uuid4()) if not short else shortuuid.ShortUUID(
             alphabet=string.ascii_lowercase + string.digits).random(length)
 
@@ -261,7 +292,7 @@ class Handler(object):
         return json.dumps(labels)
 
     def include_file(self, path: str, direct: bool = False, render: bool = True, indent: int = 4, skip: List[str] = None,
-                     escape: List[str] = None) -> str:
+                     escape: List[str] = None, sha256: str = None) -> str:
         """ Include and optionally render arbitrary files into your manifest
 
         Reads the content of the specified file and returns the corresponding format to include the read content
@@ -280,6 +311,9 @@ class Handler(object):
                 See [Skip & Escape](includes.md#skip-escape).
             escape: A list of characters to escape from the read file content.
                 See [Skip & Escape](includes.md#skip-escape).
+            sha256: An optional SHA256 checksum for files included by URL. The downloaded file must match the
+                checksum and is never downloaded again once cached.
+                See [Download Remote Files](includes.md#download-remote-files).
 
         Returns:
             str: The (rendered) file content in the requested format to include it either into a YAML document or
@@ -318,11 +352,12 @@ class Handler(object):
         if not escape:
             escape = []
 
-        tmp_path = None
+        source = None
         if path.startswith('http'):
-            tmp_path, _ = urllib.request.urlretrieve(path)
-            self.env.loader.searchpath.append(os.path.dirname(tmp_path))
-            path = os.path.basename(tmp_path)
+            # Downloads are cached in the adeploy dir, see HttpCache
+            source = HttpCache.get(path, self.log, sha256).decode('utf-8')
+            if not sha256:
+                self.env.add_volatile('include_file()')
 
         if render:
 
@@ -331,7 +366,8 @@ class Handler(object):
                 values = self.deployment.get_template_values()
 
             try:
-                data = self.env.get_template(path).render(**values)
+                template = self.env.from_string(source) if source is not None else self.env.get_template(path)
+                data = template.render(**values)
 
             except jinja2.exceptions.TemplateNotFound as e:
                 self.log and self.log.debug(f'Used Jinja variables: {json.dumps(values)}')
@@ -339,13 +375,11 @@ class Handler(object):
             except jinja2.exceptions.TemplateError as e:
                 self.log and self.log.debug(f'Used Jinja variables: {json.dumps(values)}')
                 raise errors.RenderError(f'Jinja template error in "{colors.bold(path)}": {e}')
+        elif source is not None:
+            data = source
         else:
-            data, _, _ = self.env.loader.get_source(self.env, path)
-
-        # Clean temporary stuff
-        if tmp_path is not None:
-            self.env.loader.searchpath = filter(lambda p: p != os.path.dirname(path), self.env.loader.searchpath)
-            os.remove(tmp_path)
+            data, filename, _ = self.env.loader.get_source(self.env, path)
+            self.env.add_dependency(filename)
 
         if direct:
             prefix = '\n'
@@ -391,9 +425,15 @@ class Handler(object):
             --8<-- "docs/common/includes.md:example"
         """
         contents = {}
+
+        # Files added to or removed from the dir change the result
+        self.env.add_dependency(pathlib.Path(self.templates_dir) / dir)
+
+        # Listed files can also be included or imported by their name
+        self.env.loader.add_searchpath(pathlib.Path(self.templates_dir) / dir)
+
         for item in sorted(pathlib.Path(pathlib.Path(self.templates_dir) / dir).iterdir()):
             if item.is_file():
-                self.env.loader.searchpath.append(str(item.parent))
                 contents[item.name] = self.include_file(
                     str(item.relative_to(self.templates_dir)), direct, render, indent, skip, escape)
 
@@ -492,6 +532,7 @@ class Handler(object):
             raise errors.RenderError('create_secret() requires at least one secret key to be specified')
         if not self.deployment:
             raise errors.RenderError('create_secret() cannot be used here')
+        self.env.add_volatile('create_secret()')
 
         s = secret.GenericSecret(self.deployment, data or kwargs, name, use_pass, use_gopass_cat, custom_cmd)
         if secret.Secret.register(s) and self.log:
@@ -553,6 +594,7 @@ class Handler(object):
         """
         if not self.deployment:
             raise errors.RenderError('create_tls_secret() cannot be used here')
+        self.env.add_volatile('create_tls_secret()')
 
         s = secret.TlsSecret(deployment=self.deployment, name=name, cert=cert, key=key, use_pass=use_pass,
                              use_gopass_cat=use_gopass_cat,
@@ -605,6 +647,7 @@ class Handler(object):
         """
         if not self.deployment:
             raise errors.RenderError('create_docker_registry_secret() cannot be used here')
+        self.env.add_volatile('create_docker_registry_secret()')
 
         s = secret.DockerRegistrySecret(self.deployment, server, username, password, email, name,
                                         use_pass, use_gopass_cat, custom_cmd)
@@ -640,6 +683,7 @@ class Handler(object):
             ```
         """
         from adeploy.common.secrets_provider.gopass_provider import GopassSecretProvider
+        self.env.add_volatile('from_gopass()')
         return GopassSecretProvider(path, log=self.log, use_show=use_show)
 
     def from_shell_command(self, cmd: str) -> "ShellCommandSecretProvider":
@@ -652,6 +696,7 @@ class Handler(object):
 
         """
         from adeploy.common.secrets_provider.shell_command_provider import ShellCommandSecretProvider
+        self.env.add_volatile('from_shell_command()')
         return ShellCommandSecretProvider(cmd, log=self.log)
 
     def random_string(self, length: int = 32) -> "RandomSecretProvider":
@@ -667,6 +712,7 @@ class Handler(object):
 
         """
         from adeploy.common.secrets_provider.random_provider import RandomSecretProvider
+        self.env.add_volatile('random_string()')
         return RandomSecretProvider(length, log=self.log)
 
     def from_plaintext(self, plaintext_secret) -> "PlaintextSecretProvider":
@@ -682,6 +728,7 @@ class Handler(object):
 
         """
         from adeploy.common.secrets_provider.plaintext_provider import PlaintextSecretProvider
+        self.env.add_volatile('from_plaintext()')
         return PlaintextSecretProvider(plaintext_secret, log=self.log)
 
     # Not ready to be merged
@@ -2,21 +2,19 @@ import json
 import os
 import string
 import subprocess
-import tempfile
 import random
 from logging import Logger
-from pathlib import Path
-from typing import Optional
-
-import yaml
+from typing import Dict, List, Optional, Union
 
 from adeploy.common import colors
 from adeploy.common.errors import TestError
-from adeploy.common.helpers import dict_update_recursive
 
 # See kubectl_init()
 KUBECONF = None
 
+# Current API server URL by kube config, see kubectl_get_current_api_server_url()
+_api_server_urls = {}
+
 
 def kubectl_add_default_context(log: Logger):
     kubectl(log, ['config', 'set-cluster', 'default',
@@ -72,55 +70,66 @@ def kubectl_apply(log, manifest_path, namespace=None, dry_run=None, output=None)
     return kubectl(log, args, namespace)
 
 
-def kubectl_get_secret(log, name, namespace) -> subprocess.CompletedProcess:
-    return kubectl(log, ['get', 'secret', name, '-o', 'json'], namespace)
+def kubectl_apply_manifests(log, manifests: list, namespace=None, dry_run=None,
+                            output=None) -> subprocess.CompletedProcess:
+    # Apply multiple objects in a single request from memory
+    args = ['apply', '-f', '-']
+    if dry_run:
+        args.append(f'--dry-run={dry_run}')
+    if output:
+        args += ['-o', output]
+    return kubectl(log, args, namespace, input=json.dumps(kubectl_list(manifests)))
+
+
+def kubectl_list(items: list) -> dict:
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'items': items,
+    }
 
 
-def kubectl_delete_secret(log, name, namespace) -> subprocess.CompletedProcess:
-    return kubectl(log, ['delete', 'secret', name, '-o', 'name'], namespace)
+def kubectl_get_secret(log, name, namespace) -> subprocess.CompletedProcess:
+    return kubectl(log, ['get', 'secret', name, '-o', 'json'], namespace)
 
 
-def kubectl_create_secret(log, name, namespace, type, args, labels: dict = None,
-                          dry_run: bool = None, output: str = None) -> subprocess.CompletedProcess:
-    # Get manifest for secret
-    result = kubectl(log, ['create', 'secret', type, name] + args + ['--dry-run=client', '-o', 'json'], namespace)
-    manifest = json.loads(result.stdout)
+def kubectl_get_secrets(log, namespace, selector: str = None) -> List[dict]:
+    result = kubectl(log, ['get', 'secret', '-o', 'json'] + (['-l', selector] if selector else []), namespace)
+    return json.loads(result.stdout).get('items', [])
 
-    # Add labels
-    manifest = dict_update_recursive(manifest, {
-        'metadata': {
-            'labels': labels
-        }
-    })
 
-    fd = tempfile.NamedTemporaryFile(delete=False, mode='w')
-    yaml.dump(manifest, fd)
-    fd.close()
+def kubectl_get_secret_names(log, namespace) -> List[str]:
+    result = kubectl(log, ['get', 'secret', '-o', 'jsonpath={.items[*].metadata.name}'], namespace)
+    return [s for s in result.stdout.split(' ') if len(s) > 0]
 
-    # Apply manifest
-    args = []
-    if dry_run:
-        args.append(f'--dry-run={dry_run}')
 
-    if output:
-        args += ['-o', output]
+def kubectl_get_secret_annotation(log, namespace, annotation: str) -> Dict[str, Optional[str]]:
+    # Get all secret names with the given annotation, missing annotations are returned as None
+    annotation = annotation.replace('.', '\\.')
+    result = kubectl(log, ['get', 'secret', '-o',
+                           f'jsonpath={{range .items[*]}}{{.metadata.name}}{{"\\t"}}'
+                           f'{{.metadata.annotations.{annotation}}}{{"\\n"}}{{end}}'], namespace)
+    secrets = {}
+    for line in result.stdout.split('\n'):
+        if len(line.strip()) > 0:
+            name, _, value = line.partition('\t')
+            secrets[name] = value if len(value) > 0 else None
+    return secrets
 
-    try:
-        result = kubectl(log, ['apply', '-f', fd.name] + args, namespace)
-    finally:
-        os.remove(fd.name)
 
-    return result
+def kubectl_delete_secret(log, name: Union[str, List[str]], namespace) -> subprocess.CompletedProcess:
+    names = [name] if isinstance(name, str) else name
+    return kubectl(log, ['delete', 'secret'] + names + ['-o', 'name'], namespace)
 
 
-def kubectl(log: Logger, args: list, namespace: str = None) -> subprocess.CompletedProcess:
+def kubectl(log: Logger, args: list, namespace: str = None, input: str = None) -> subprocess.CompletedProcess:
     cmd = ['kubectl', '--kubeconfig', str(KUBECONF)]
     if namespace:
         cmd += ['-n', namespace]
     cmd += args
 
     log.debug(f'Executing command {colors.bold(" ".join(cmd))}')
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, capture_output=True, text=True, input=input)
     result.check_returncode()
     return result
 
@@ -140,9 +149,10 @@ def kubectl_init(args):
 
 
 def parse_kubectrl_apply(log, stdout, manifests: dict = None, fake_ns: str = None, default_ns: str = None,
-                         deployment_ns: str = None, prefix='...'):
+                         deployment_ns: str = None, prefix='...', namespaces: List[str] = None):
     # If there is no fake_ns, we need to determine by comparing existing namespaces
-    namespaces = kubectl_get_namespaces(log)
+    if namespaces is None:
+        namespaces = kubectl_get_namespaces(log)
 
     for line in stdout.split('\n'):
         token = line.split(' ')
@@ -194,9 +204,14 @@ def parse_kubectrl_apply(log, stdout, manifests: dict = None, fake_ns: str = Non
 
 
 def kubectl_get_current_api_server_url(log: Logger) -> Optional[str]:
+    # Queried once per process, as each provider of each step needs it
+    if str(KUBECONF) in _api_server_urls:
+        return _api_server_urls[str(KUBECONF)]
+
     args = ['config', 'view', '--minify', '--output', 'jsonpath="{.clusters[*].cluster.server}"']
     try:
-        return json.loads(kubectl(log=log, args=args).stdout)
+        _api_server_urls[str(KUBECONF)] = json.loads(kubectl(log=log, args=args).stdout)
+        return _api_server_urls[str(KUBECONF)]
     except subprocess.CalledProcessError as e:
         log.error(f'Could not get current api server url: {e.stderr}')
         return None
@@ -32,4 +32,39 @@ def get_log_format(args, loglevel):
     if loglevel == logging.DEBUG:
         return '%(levelname)-8s ' + colors.bold('%(name)s') + ' %(message)s'
 
-    return colors.bold('%(name)s') + ' %(message)s'
\ No newline at end of file
+    return colors.bold('%(name)s') + ' %(message)s'
+
+
+class BufferedLogger:
+    """
+    A logger that buffers all messages until flush() is called. This is used to emit the messages of concurrent jobs
+    in a deterministic order.
+    """
+
+    def __init__(self, log: logging.Logger):
+        self.log = log
+        self.records = []
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self.log.isEnabledFor(level)
+
+    def log_record(self, level: int, msg, *args, **kwargs):
+        if self.log.isEnabledFor(level):
+            self.records.append((level, msg, args, kwargs))
+
+    def debug(self, msg, *args, **kwargs):
+        self.log_record(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log_record(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log_record(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log_record(logging.ERROR, msg, *args, **kwargs)
+
+    def flush(self):
+        for level, msg, args, kwargs in self.records:
+            self.log.log(level, msg, *args, **kwargs)
+        self.records = []
@@ -1,16 +1,16 @@
-import glob
 import os
 import sys
 from abc import ABC, abstractmethod
 from argparse import Namespace
 from logging import Logger
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 from packaging.version import parse as parse_version
 
 from adeploy.common import colors
 from adeploy.common.deployment import Deployment
+from adeploy.common.deployment_index import DeploymentIndex
 from adeploy.common.errors import RenderError, WrongClusterError
 from adeploy.common.kubectl import kubectl_get_current_api_server_url
 from adeploy.common.version import get_git_version, get_package_version
@@ -27,6 +27,14 @@ class Provider(ABC):
 
     extensions: list = ['yml', 'yaml']
 
+    # Use the deployment configs evaluated by a previous step if unchanged, see Deployment.load_cached_config()
+    config_cache: bool = False
+
+    __defaults_file: Path = None
+
+    # Deployments loaded by a previous step of the same process if enabled, see Provider.share_deployments()
+    __shared_deployments: Optional[Dict[tuple, List[Deployment]]] = None
+
     def __init__(self, name: str, src_dir: str or Path, build_dir: str or Path, namespaces_dir: str or Path,
                  args: Namespace, log: Logger, defaults_path: str or Path = None, **kwargs):
 
@@ -50,6 +58,14 @@ class Provider(ABC):
 
     def get_defaults_file(self) -> Optional[Path]:
 
+        # Resolve the defaults file once, but re-resolve if it was removed i.e. in watch mode
+        if self.__defaults_file is None or not self.__defaults_file.is_file():
+            self.__defaults_file = self.find_defaults_file()
+
+        return self.__defaults_file
+
+    def find_defaults_file(self) -> Optional[Path]:
+
         if self.defaults_path.exists():
 
             # <defaults_path>
@@ -72,8 +88,21 @@ class Provider(ABC):
         self.log.warning(f'Could not find a default file from path "{colors.bold(self.defaults_path)}", continue ...')
         return None
 
+    @staticmethod
+    def share_deployments():
+        """
+        Reuse the deployments loaded by the first provider for the following providers i.e. in a pipeline.
+        """
+        if Provider.__shared_deployments is None:
+            Provider.__shared_deployments = {}
+
     def load_deployments(self):
 
+        key = (self.name, str(self.namespaces_dir), str(self.build_dir), str(self.get_defaults_file()))
+        if Provider.__shared_deployments is not None and key in Provider.__shared_deployments:
+            self.log.debug(f'Using deployments loaded by a previous step ...')
+            return list(Provider.__shared_deployments[key])
+
         self.log.debug(
             f'Scanning for deployment variables in "{self.namespaces_dir}/*/*.({"|".join(self.extensions)})" ...')
 
@@ -82,54 +111,57 @@ class Provider(ABC):
 
         deployments = []
 
-        for ns in [d for d in os.listdir(str(self.namespaces_dir)) if self.namespaces_dir.joinpath(d).is_dir()]:
-
-            # Structure 2
-            deployment_dir = self.namespaces_dir.joinpath(ns).joinpath(self.name)
-            if not deployment_dir.is_dir():
-                # Structure 1
-                deployment_dir = self.namespaces_dir.joinpath(ns)
-
-            for ext in self.extensions:
-                for deployment_release_config in [Path(p) for p in glob.glob(f'{deployment_dir}/*.{ext}')]:
-                    deployment_release = deployment_release_config.stem
-                    deployment = Deployment(self.name, deployment_release, ns, str(self.build_dir))
-
-                    if deployment.skipped(self.args):
-                        self.log.info(f'... Deployment "{colors.blue(deployment)}" skipped by user filter.')
-                        continue
-
-                    self.log.debug(f'Found deployment "{colors.blue(deployment)}", namespace "{colors.bold(ns)}" ...')
-
-                    deployment.load_config(deployment_release_config, self.get_defaults_file(), self.log)
-                    self.log.debug(f'Using config from "{colors.bold(deployment_release_config)}" ...')
-
-                    # Check valid deployment versions
-                    version = get_package_version()
-                    if not version:
-                        # If version cannot be determined then we're likely running from source
-                        version = get_git_version()
-                    deployment_version = deployment.config.get('_adeploy', {}).get('version', '0.0.0')
-                    if parse_version(str(deployment_version)) > parse_version(version.split('-')[0]):
-                        raise RenderError(f'Deployment requires at least '
-                                          f'adeploy version {deployment_version}, '
-                                          f'current version is {version}')
-
-                    # Check valid target cluster
-                    deployment_target_cluster = deployment.config.get('_adeploy', {}).get(
-                        'target_cluster_apiserver_url', None)
-                    if deployment_target_cluster and deployment_target_cluster != self.current_cluster:
-                        raise WrongClusterError(f'Deployment target cluster is "{deployment_target_cluster}", '
-                                                f'but current cluster is {self.current_cluster}')
-
-                    deployments.append(deployment)
+        for ns, deployment_release_config in DeploymentIndex.load(self.log, self.namespaces_dir, self.name,
+                                                                  self.extensions):
+            deployment = self.load_deployment(ns, deployment_release_config)
+            if deployment:
+                deployments.append(deployment)
 
         if self.args.show_configs:
             print("Hello World")
             sys.exit(0)
 
+        if Provider.__shared_deployments is not None:
+            Provider.__shared_deployments[key] = list(deployments)
+
         return deployments
 
+    def load_deployment(self, ns: str, deployment_release_config: Path) -> Optional[Deployment]:
+        deployment_release = deployment_release_config.stem
+        deployment = Deployment(self.name, deployment_release, ns, str(self.build_dir))
+
+        if deployment.skipped(self.args):
+            self.log.info(f'... Deployment "{colors.blue(deployment)}" skipped by user filter.')
+            return None
+
+        self.log.debug(f'Found deployment "{colors.blue(deployment)}", namespace "{colors.bold(ns)}" ...')
+
+        if not self.config_cache or getattr(self.args, 'no_config_cache', False) or \
+                not deployment.load_cached_config(deployment_release_config, self.get_defaults_file(), self.log):
+            deployment.load_config(deployment_release_config, self.get_defaults_file(), self.log)
+            deployment.store_config(self.get_defaults_file(), self.log)
+        self.log.debug(f'Using config from "{colors.bold(deployment_release_config)}" ...')
+
+        # Check valid deployment versions
+        version = get_package_version()
+        if not version:
+            # If version cannot be determined then we're likely running from source
+            version = get_git_version()
+        deployment_version = deployment.config.get('_adeploy', {}).get('version', '0.0.0')
+        if parse_version(str(deployment_version)) > parse_version(version.split('-')[0]):
+            raise RenderError(f'Deployment requires at least '
+                              f'adeploy version {deployment_version}, '
+                              f'current version is {version}')
+
+        # Check valid target cluster
+        deployment_target_cluster = deployment.config.get('_adeploy', {}).get(
+            'target_cluster_apiserver_url', None)
+        if deployment_target_cluster and deployment_target_cluster != self.current_cluster:
+            raise WrongClusterError(f'Deployment target cluster is "{deployment_target_cluster}", '
+                                    f'but current cluster is {self.current_cluster}')
+
+        return deployment
+
     def verify_current_cluster_is_last_cluster(self, deployment) -> bool:
         last_cluster = deployment.get_last_cluster()
         if last_cluster and last_cluster != self.current_cluster:
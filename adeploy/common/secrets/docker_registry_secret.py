@@ -1,14 +1,14 @@
-import subprocess
+import json
 from logging import Logger
 from typing import Union
 
-from adeploy.common.kubectl import kubectl_create_secret
 from adeploy.common.secrets.secret import Secret
 from adeploy.common.secrets_provider.provider import SecretsProvider
 
 
 class DockerRegistrySecret(Secret):
     type: str = "docker-registry"
+    k8s_type: str = "kubernetes.io/dockerconfigjson"
     server: str = None
     username: str = None
     password: str = None
@@ -25,21 +25,20 @@ class DockerRegistrySecret(Secret):
     def _is_legacy_secret(self) -> bool:
         return not isinstance(self.password, SecretsProvider)
 
-    def create(self, log: Logger = None, dry_run: str = None, output: str = None) -> subprocess.CompletedProcess:
-        args = [f'--docker-server={self.server}',
-                f'--docker-username={self.username}']
+    def get_docker_config(self, log: Logger = None, dry_run: Union[bool, str] = False) -> dict:
+        # Same format as created by "kubectl create secret docker-registry"
+        password = self.get_value(self.password, log, dry_run=dry_run)
+        auth = {
+            'username': self.username,
+            'password': password,
+        }
 
         if self.email:
-            args.append(f'--docker-email={self.email}')
-
-        args.append(f'--docker-password={self.get_value(self.password, log, dry_run=dry_run)}')
-
-        return kubectl_create_secret(
-            log=log, name=self.name,
-            namespace=self.deployment.namespace,
-            type=self.type, dry_run=dry_run,
-            args=args, output=output,
-            labels={
-                'adeploy.name': self.deployment.name,
-                'adeploy.release': self.deployment.release
-            })
+            auth['email'] = self.email
+
+        auth['auth'] = Secret.encode(f'{self.username}:{password}')
+
+        return {'auths': {self.server: auth}}
+
+    def get_data(self, log: Logger = None, dry_run: Union[bool, str] = False) -> dict:
+        return {'.dockerconfigjson': json.dumps(self.get_docker_config(log, dry_run=dry_run))}
@@ -1,27 +1,27 @@
-import glob
+import base64
 import hashlib
+import importlib
 import json
-import shutil
 import subprocess
 import warnings
 
 from abc import ABC, abstractmethod
 from logging import Logger
 from pathlib import Path
-from pickle import dump, load
 from typing import Union
 
 from adeploy.common import colors
 from adeploy.common.errors import RenderError
 from adeploy.common.secrets_provider.gopass_provider import GopassSecretProvider
-from adeploy.common.kubectl import parse_kubectrl_apply, kubectl_get_secret, \
-    kubectl_delete_secret, kubectl
+from adeploy.common.kubectl import parse_kubectrl_apply, kubectl_get_secret_names, kubectl_apply_manifests, \
+    kubectl_list, kubectl_delete_secret, kubectl_get_secret_annotation, kubectl
 from adeploy.common.secrets_provider.provider import SecretsProvider
 from adeploy.common.secrets_provider.shell_command_provider import ShellCommandSecretProvider
 
 
 class Secret(ABC):
     type: str = None
+    k8s_type: str = None
     name: str = None
     deployment = None
     use_pass: bool = True           # Deprecated
@@ -30,22 +30,59 @@ class Secret(ABC):
 
     _name_prefix = 'secret-'
     _secrets = {}
+    _manifest_version = 1
+    _provider_key = '$provider'
+    _hash_annotation = 'adeploy.hash'
 
     @staticmethod
-    def get_secret_dir(build_dir: Path, deployment_name: str):
-        return build_dir.joinpath(deployment_name).joinpath('secrets')
+    def get_manifest_path(build_dir: Path, deployment_name: str) -> Path:
+        # Not in the build dir of the deployment, as this is removed when rendering, see Deployment.clean_build_dir()
+        return build_dir.joinpath('.secrets').joinpath(f'{deployment_name}.json')
 
     @staticmethod
-    def clean_build_secrets(build_dir: Path):
-        for secret in Secret.get_registered():
-            secrets_dir = secret.get_path(build_dir).parent
-            if secrets_dir.exists():
-                shutil.rmtree(secrets_dir)
+    def load_manifest(build_dir: Path, deployment_name: str) -> dict:
+        manifest_path = Secret.get_manifest_path(build_dir, deployment_name)
+        try:
+            with open(str(manifest_path), 'r') as fd:
+                manifest = json.load(fd)
+        except FileNotFoundError:
+            return {'version': Secret._manifest_version, 'deployments': {}}
+
+        if manifest.get('version') != Secret._manifest_version:
+            raise RenderError(f'Unsupported secret manifest version {manifest.get("version")} '
+                              f'in "{colors.bold(manifest_path)}", please re-render.')
+        return manifest
 
     @staticmethod
-    def load(path: Path):
-        with open(str(path), 'rb') as fd:
-            return load(fd)
+    def store_registered(build_dir: Path, deployment_name: str, args=None):
+        from adeploy.common.deployment import Deployment
+
+        # Group registered secrets of the deployment name by deployment
+        deployments = {}
+        for s in Secret.get_registered():
+            d = s.deployment
+            if d.name != deployment_name:
+                continue
+            deployments.setdefault(f'{d.namespace}/{d.release}', {
+                'namespace': d.namespace,
+                'release': d.release,
+                'secrets': [],
+            })['secrets'].append(s.to_dict())
+
+        # Deployments excluded by user filters were not rendered, so their secrets are kept. All others were rendered
+        # or removed, so their secrets are replaced by the registered ones.
+        manifest = Secret.load_manifest(build_dir, deployment_name)
+        manifest['deployments'] = {k: entry for k, entry in manifest['deployments'].items() if args and Deployment(
+            deployment_name, entry.get('release'), entry.get('namespace'), str(build_dir)).skipped(args)}
+        manifest['deployments'].update(deployments)
+
+        manifest_path = Secret.get_manifest_path(build_dir, deployment_name)
+        if len(deployments) == 0 and not manifest_path.exists():
+            return
+
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(manifest_path), 'w') as fd:
+            json.dump(manifest, fd, sort_keys=True)
 
     @staticmethod
     def register(s):
@@ -60,11 +97,23 @@ class Secret(ABC):
         return Secret._secrets.values()
 
     @staticmethod
-    def get_stored(build_dir: Path, deployment_name: str):
-        secrets_dir = Secret.get_secret_dir(build_dir, deployment_name)
+    def get_stored(build_dir: Path, deployment_name: str, args=None, log: Logger = None):
+        from adeploy.common.deployment import Deployment
+
         secrets = []
-        for secret in glob.glob(f'{secrets_dir}/*/*/*'):
-            secrets.append(Secret.load(Path(secret)))
+        for entry in Secret.load_manifest(build_dir, deployment_name).get('deployments', {}).values():
+            deployment = Deployment(deployment_name, entry.get('release'), entry.get('namespace'), str(build_dir))
+
+            # Respect user filters without restoring the secrets
+            if args and deployment.skipped(args):
+                if log:
+                    log.info(f'... Secrets for deployment "{colors.blue(deployment)}" skipped by user filter.')
+                continue
+
+            # Reuse the secrets registered while rendering in the same process i.e. in a pipeline
+            secrets += [Secret._secrets.get(f'{deployment}/{s.get("name")}') or Secret.from_dict(s, deployment, log)
+                        for s in entry.get('secrets', [])]
+
         return secrets
 
     @staticmethod
@@ -190,63 +239,165 @@ class Secret(ABC):
                     obj_dict[key] = val
         return f'{Secret._name_prefix}{hashlib.sha1(json.dumps(obj_dict).encode()).hexdigest()}'
 
-    def get_path(self, build_dir):
-        return Secret.get_secret_dir(build_dir, self.deployment.name).joinpath(self.deployment.namespace).joinpath(
-            self.deployment.release).joinpath(
-            self.name)
+    @staticmethod
+    def _to_value(value):
+        if isinstance(value, SecretsProvider):
+            return {Secret._provider_key: value.to_ref()}
+        if isinstance(value, dict):
+            return {k: Secret._to_value(v) for k, v in value.items()}
+        return value
 
-    def store(self, build_dir: Path):
-        output_path = self.get_path(build_dir)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(str(output_path), 'wb') as fd:
-            dump(self, fd)
+    @staticmethod
+    def _from_value(value, log: Logger = None):
+        if isinstance(value, dict):
+            if Secret._provider_key in value:
+                return SecretsProvider.from_ref(value.get(Secret._provider_key), log)
+            return {k: Secret._from_value(v, log) for k, v in value.items()}
+        return value
+
+    def to_dict(self) -> dict:
+        data = {'class': f'{self.__class__.__module__}.{self.__class__.__name__}'}
+        for key, val in self.__dict__.items():
+            # The deployment is referenced by namespace and release in the manifest
+            if key != 'deployment':
+                data[key] = Secret._to_value(val)
+        return data
 
-    def exists(self, log: Logger):
-        try:
-            kubectl_get_secret(log, self.name, self.deployment.namespace)
-            return True
-        except subprocess.CalledProcessError:
-            pass
-        return False
+    @staticmethod
+    def from_dict(data: dict, deployment, log: Logger = None):
+        # Only restore secret classes of adeploy, as the class is taken from the manifest
+        module_name, _, class_name = str(data.get('class')).rpartition('.')
+        cls = getattr(importlib.import_module(module_name), class_name, None) \
+            if module_name.startswith('adeploy.common.secrets.') else None
+        if not isinstance(cls, type) or not issubclass(cls, Secret):
+            raise RenderError(f'Unsupported secret class "{colors.bold(data.get("class"))}" in secret manifest, '
+                              f'please re-render.')
+
+        # Don't call the constructor to skip name generation and deprecation warnings
+        s = cls.__new__(cls)
+        for key, val in data.items():
+            if key != 'class':
+                setattr(s, key, Secret._from_value(val, log))
+        s.deployment = deployment
+        return s
 
-    def test(self, log: Logger):
-        log.info(f'Testing secret "{colors.bold(self)}" for deployment "{colors.blue(self.deployment)}" ...')
+    @staticmethod
+    def encode(value: Union[str, bytes, bytearray]) -> str:
+        if not isinstance(value, (bytes, bytearray)):
+            value = str(value).encode('utf-8')
+        return base64.b64encode(value).decode('utf-8')
 
-        # Test whether this secret is already deployed
-        if self.exists(log):
-            log.info(f'... secret already exists. '
-                     f'{colors.orange("The secret will not be re-created unless --recreate-secrets was specified.")}')
-            return
+    @staticmethod
+    def group_by_namespace(secrets) -> dict:
+        namespaces = {}
+        for s in secrets:
+            namespaces.setdefault(s.deployment.namespace, []).append(s)
+        return namespaces
 
-        # Test creating the secret using kubectl
-        try:
-            manifest = self.create(log, dry_run='client', output='json')
-            result = self.create(log, dry_run='server')
-            parse_kubectrl_apply(log, result.stdout,
-                                 manifests=json.loads(manifest.stdout),
-                                 deployment_ns=self.deployment.namespace)
-
-        except subprocess.CalledProcessError as e:
-            raise RenderError(
-                f'Error while creating (dry-run) secret "{colors.bold(self.name)}": {e}\n{e.stderr.strip()}')
-
-    def deploy(self, log: Logger, recreate=False):
-
-        if self.exists(log):
-            if recreate:
-                kubectl_delete_secret(log, self.name, self.deployment.namespace)
-                log.info(f'... remove existing secret "{colors.bold(self)}" in order to re-create ...')
-            else:
-                log.info(f'... skip re-creating existing secret "{colors.bold(self)}"')
-                return
+    def get_labels(self) -> dict:
+        return {
+            'adeploy.name': self.deployment.name,
+            'adeploy.release': self.deployment.release
+        }
 
-        # Creating the secret using kubectl
-        try:
-            log.info(f'... creating secret "{colors.bold(self)}" ...')
-            self.create(log)
-        except subprocess.CalledProcessError as e:
-            raise RenderError(f'Error while creating secret "{colors.bold(self.name)}": {e}\n{e.stderr.strip()}')
+    @staticmethod
+    def get_hash(k8s_type: str, data: dict) -> str:
+        return hashlib.sha256(json.dumps({'type': k8s_type, 'data': data}, sort_keys=True).encode()).hexdigest()
+
+    def get_manifest(self, log: Logger = None, dry_run: Union[bool, str] = False) -> dict:
+        data = {k: Secret.encode(v) for k, v in self.get_data(log, dry_run=dry_run).items()}
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Secret',
+            'metadata': {
+                'name': self.name,
+                'namespace': self.deployment.namespace,
+                'labels': self.get_labels(),
+                'annotations': {
+                    Secret._hash_annotation: Secret.get_hash(self.k8s_type, data),
+                },
+            },
+            'type': self.k8s_type,
+            'data': data,
+        }
+
+    @staticmethod
+    def test_all(secrets, log: Logger):
+        for namespace, secrets in Secret.group_by_namespace(secrets).items():
+
+            # Test whether the secrets are already deployed
+            secrets_existing = kubectl_get_secret_names(log, namespace)
+
+            manifests = []
+            for s in secrets:
+                log.info(f'Testing secret "{colors.bold(s)}" for deployment "{colors.blue(s.deployment)}" ...')
+                if s.name in secrets_existing:
+                    log.info(f'... secret already exists. '
+                             f'{colors.orange("The secret will not be re-created unless --recreate-secrets or --sync-secrets was specified.")}')
+                    continue
+                manifests.append(s.get_manifest(log, dry_run=True))
+
+            if len(manifests) == 0:
+                continue
+
+            # Test creating the secrets in a single request
+            try:
+                result = kubectl_apply_manifests(log, manifests, namespace=namespace, dry_run='server')
+                parse_kubectrl_apply(log, result.stdout,
+                                     manifests=kubectl_list(manifests),
+                                     deployment_ns=namespace)
+
+            except subprocess.CalledProcessError as e:
+                raise RenderError(
+                    f'Error while creating (dry-run) secrets in namespace "{colors.bold(namespace)}": '
+                    f'{e}\n{e.stderr.strip()}')
+
+    @staticmethod
+    def deploy_all(secrets, log: Logger, recreate=False, sync=False):
+        for namespace, secrets in Secret.group_by_namespace(secrets).items():
+
+            # Existing secrets and their content hashes from a single listing
+            secrets_existing = kubectl_get_secret_annotation(log, namespace, Secret._hash_annotation)
+
+            secrets_delete = []
+            manifests = []
+            for s in secrets:
+                manifest = None
+                if s.name in secrets_existing:
+                    if recreate:
+                        log.info(f'... remove existing secret "{colors.bold(s)}" in order to re-create ...')
+                        secrets_delete.append(s.name)
+
+                    elif sync:
+                        manifest = s.get_manifest(log)
+                        if manifest['metadata']['annotations'][Secret._hash_annotation] == secrets_existing[s.name]:
+                            log.info(f'... skip re-creating unchanged secret "{colors.bold(s)}"')
+                            continue
+
+                        log.info(f'... remove changed secret "{colors.bold(s)}" in order to re-create ...')
+                        secrets_delete.append(s.name)
+
+                    else:
+                        log.info(f'... skip re-creating existing secret "{colors.bold(s)}"')
+                        continue
+
+                log.info(f'... creating secret "{colors.bold(s)}" ...')
+                manifests.append(manifest if manifest else s.get_manifest(log))
+
+            # Creating the secrets in a single request
+            try:
+                if len(secrets_delete) > 0:
+                    kubectl_delete_secret(log, secrets_delete, namespace)
+                if len(manifests) > 0:
+                    kubectl_apply_manifests(log, manifests, namespace=namespace)
+
+            except subprocess.CalledProcessError as e:
+                raise RenderError(f'Error while creating secrets in namespace "{colors.bold(namespace)}": '
+                                  f'{e}\n{e.stderr.strip()}')
 
     @abstractmethod
-    def create(self, log: Logger = None, dry_run: str = None, output: str = None) -> subprocess.CompletedProcess:
+    def get_data(self, log: Logger = None, dry_run: Union[bool, str] = False) -> dict:
+        """
+        Return the secret data as dict of keys and (unencoded) values.
+        """
         pass
@@ -1,10 +1,6 @@
-import os
-import subprocess
-import tempfile
 from logging import Logger
 from typing import Union
 
-from adeploy.common.kubectl import kubectl_create_secret
 from adeploy.common.secrets.secret import Secret
 from adeploy.common.secrets_provider.provider import SecretsProvider
 
@@ -68,6 +64,7 @@ lnUqJtp1zChmcVqRN2f8m9XX59Kgt90RnlCQ0Vl010ovo+y8bCmbsjHzI2SlZ012
 
 class TlsSecret(Secret):
     type: str = "tls"
+    k8s_type: str = "kubernetes.io/tls"
     cert: str = None
     key: str = None
 
@@ -80,40 +77,8 @@ class TlsSecret(Secret):
         self.key = key
         super().__init__(deployment, name, use_pass, use_gopass_cat, custom_cmd)
 
-    def create(self, log: Logger = None, dry_run: str = None, output: str = None) -> subprocess.CompletedProcess:
-
-        cert_data = _DUMMY_DATA_CRT if dry_run else self.get_value(self.cert, log, dry_run=False)
-        cert = tempfile.NamedTemporaryFile(delete=False,
-                                           mode='wb' if isinstance(cert_data, (bytes, bytearray)) else 'w')
-        cert.write(cert_data)
-        cert.close()
-
-        key_data = _DUMMY_DATA_KEY if dry_run else self.get_value(self.key, log, dry_run=False)
-        key = tempfile.NamedTemporaryFile(delete=False, mode='wb' if isinstance(key_data, (bytes, bytearray)) else 'w')
-        key.write(key_data)
-        key.close()
-
-        args = [
-            f'--cert={cert.name}',
-            f'--key={key.name}',
-        ]
-
-        try:
-
-            result = kubectl_create_secret(
-                log=log,
-                name=self.name,
-                namespace=self.deployment.namespace,
-                type=self.type,
-                args=args,
-                output=output,
-                labels={
-                    'adeploy.name': self.deployment.name,
-                    'adeploy.release': self.deployment.release
-                })
-
-        finally:
-            os.remove(cert.name)
-            os.remove(key.name)
-
-        return result
+    def get_data(self, log: Logger = None, dry_run: Union[bool, str] = False) -> dict:
+        return {
+            'tls.crt': _DUMMY_DATA_CRT if dry_run else self.get_value(self.cert, log, dry_run=False),
+            'tls.key': _DUMMY_DATA_KEY if dry_run else self.get_value(self.key, log, dry_run=False),
+        }
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+from logging import Logger
+from pathlib import Path
+from typing import Optional, Union
+
+from adeploy.common import colors
+from adeploy.common.args import get_args
+from adeploy.common.errors import InputError
+
+
+class SecretsCache:
+    """
+    An opt-in encrypted on-disk cache for secret values, enabled by --secrets-cache.
+    Values are encrypted using Fernet from the `cryptography` package. The key is taken from the env var
+    ADEPLOY_SECRETS_CACHE_KEY or from the OS keyring using the `keyring` package.
+    Cache entries are keyed by the secrets provider type, its ID and the inputs the value depends on, see
+    SecretsProvider.get_cache_scope(). Entries expire after --secrets-cache-ttl seconds.
+    """
+    KEY_ENV = 'ADEPLOY_SECRETS_CACHE_KEY'
+    KEYRING_SERVICE = 'adeploy'
+    KEYRING_USERNAME = 'secrets-cache'
+
+    __fernet = None
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return getattr(get_args(), 'secrets_cache', False)
+
+    @staticmethod
+    def get_cache_dir() -> Path:
+        return Path(get_args().adeploy_dir).joinpath('secrets-cache')
+
+    @staticmethod
+    def get_path(source: str, id: str, scope: list = None) -> Path:
+        key = hashlib.sha256(json.dumps([source, id, scope or []], sort_keys=True).encode()).hexdigest()
+        return SecretsCache.get_cache_dir().joinpath(key)
+
+    @staticmethod
+    def purge(log: Logger):
+        cache_dir = SecretsCache.get_cache_dir()
+        log.info(f'Purging secrets cache in "{colors.bold(cache_dir)}" ...')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    @classmethod
+    def get_fernet(cls):
+        if cls.__fernet:
+            return cls.__fernet
+
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            raise InputError('The secrets cache requires the "cryptography" package, please install it first.')
+
+        key = os.getenv(cls.KEY_ENV)
+        if not key:
+            try:
+                import keyring
+            except ImportError:
+                raise InputError(f'The secrets cache requires a key in the env var {cls.KEY_ENV} or the "keyring" '
+                                 f'package to store a key in the OS keyring.')
+
+            key = keyring.get_password(cls.KEYRING_SERVICE, cls.KEYRING_USERNAME)
+            if not key:
+                key = Fernet.generate_key().decode()
+                keyring.set_password(cls.KEYRING_SERVICE, cls.KEYRING_USERNAME, key)
+
+        try:
+            cls.__fernet = Fernet(key)
+        except ValueError as e:
+            raise InputError(f'Invalid secrets cache key, expected 32 url-safe base64-encoded bytes: {e}')
+        return cls.__fernet
+
+    @staticmethod
+    def get(source: str, id: str, log: Logger, scope: list = None) -> Optional[Union[str, bytes]]:
+        path = SecretsCache.get_path(source, id, scope)
+        try:
+            token = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        # Fails with an input error if cryptography is not installed
+        fernet = SecretsCache.get_fernet()
+        from cryptography.fernet import InvalidToken
+
+        try:
+            entry = json.loads(fernet.decrypt(token, ttl=get_args().secrets_cache_ttl))
+        except InvalidToken:
+            # Either expired or encrypted with a different key
+            log.debug(f'... removing expired secrets cache entry for "{colors.bold(id)}"')
+            path.unlink(missing_ok=True)
+            return None
+
+        log.debug(f'... using cached value for "{colors.bold(id)}"')
+        value = entry.get('value')
+        return base64.b64decode(value) if entry.get('binary') else value
+
+    @staticmethod
+    def set(source: str, id: str, value: Union[str, bytes], scope: list = None):
+        binary = isinstance(value, (bytes, bytearray))
+        entry = {
+            'binary': binary,
+            'value': base64.b64encode(value).decode() if binary else value,
+        }
+
+        path = SecretsCache.get_path(source, id, scope)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        path.write_bytes(SecretsCache.get_fernet().encrypt(json.dumps(entry).encode()))
+        path.chmod(0o600)
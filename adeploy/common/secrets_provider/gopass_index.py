@@ -0,0 +1,105 @@
+import json
+import subprocess
+import time
+from logging import Logger
+from pathlib import Path
+from typing import List, Optional
+
+from adeploy.common import colors
+from adeploy.common.args import get_args
+
+
+class GopassIndex:
+    """
+    A flat index of all entries in the configured gopass stores.
+    The index is built from a single `gopass ls --flat` and cached in the adeploy dir, so that secrets can be
+    resolved to the repo they are stored in without probing each repo using `gopass cat`.
+    """
+    VERSION = 1
+    TTL = 3600
+
+    __entries = None
+    __refreshed = False
+
+    @staticmethod
+    def get_index_file() -> Path:
+        return Path(get_args().adeploy_dir).joinpath('gopass').joinpath('index.json')
+
+    @staticmethod
+    def normalize(path: str or Path) -> str:
+        return str(path).strip('/')
+
+    @classmethod
+    def load(cls, repos: List[str], log: Logger) -> set:
+        if cls.__entries is not None:
+            return cls.__entries
+
+        index_file = cls.get_index_file()
+        try:
+            with open(index_file, 'r') as fd:
+                index = json.load(fd)
+
+            # Invalidate on version change, changed repos or if the index is outdated
+            if index.get('version') == cls.VERSION \
+                    and index.get('repos') == repos \
+                    and time.time() - index.get('created', 0) < cls.TTL:
+                log.debug(f'Using gopass index from "{colors.bold(index_file)}" ...')
+                cls.__entries = set(index.get('entries', []))
+                return cls.__entries
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        return cls.refresh(repos, log)
+
+    @classmethod
+    def refresh(cls, repos: List[str], log: Logger) -> Optional[set]:
+        cls.__refreshed = True
+
+        cmd = ['gopass', 'ls', '--flat']
+        log.debug(f'Executing command {colors.bold(" ".join(cmd))}')
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            log.debug(f'... cannot list gopass stores, not using an index: {result.stderr.strip()}')
+            cls.__entries = set()
+            return cls.__entries
+
+        cls.__entries = set([cls.normalize(e) for e in result.stdout.split('\n') if len(e.strip()) > 0])
+        log.debug(f'... found {colors.bold(len(cls.__entries))} gopass entries')
+
+        index_file = cls.get_index_file()
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(index_file, 'w') as fd:
+            json.dump({
+                'version': cls.VERSION,
+                'repos': repos,
+                'created': time.time(),
+                'entries': sorted(cls.__entries),
+            }, fd)
+        index_file.chmod(0o600)
+
+        return cls.__entries
+
+    @classmethod
+    def invalidate(cls):
+        cls.__entries = None
+        cls.get_index_file().unlink(missing_ok=True)
+
+    @classmethod
+    def find(cls, candidates: List[Path], repos: List[str], log: Logger) -> Optional[Path]:
+        """
+        Return the first candidate path that is in the index. If none is found, the index is refreshed once per run
+        to account for secrets added after the index was created.
+        """
+        entries = cls.load(repos, log)
+        for candidate in candidates:
+            if cls.normalize(candidate) in entries:
+                return candidate
+
+        if not cls.__refreshed:
+            entries = cls.refresh(repos, log)
+            for candidate in candidates:
+                if cls.normalize(candidate) in entries:
+                    return candidate
+
+        return None
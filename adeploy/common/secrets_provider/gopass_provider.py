@@ -12,6 +12,7 @@ from packaging.version import parse as parse_version
 from adeploy.common import colors
 from adeploy.common.args import get_args
 from adeploy.common.errors import InputError
+from adeploy.common.secrets_provider.gopass_index import GopassIndex
 from adeploy.common.secrets_provider.provider import SecretsProvider
 
 
@@ -23,6 +24,7 @@ class GopassSecretProvider(SecretsProvider):
     in the environment variable ADEPLOY_GOPASS_REPOS or the command line argument --gopass-repo.
     """
     REQUIRED_GOPASS_VERSION = '1.10.0'
+    cacheable = True
     __found_version = None
     __warned = False
 
@@ -43,6 +45,10 @@ class GopassSecretProvider(SecretsProvider):
     def get_id(self):
         return self.path
 
+    def get_cache_scope(self) -> list:
+        # The same path may resolve to different secrets depending on the repos
+        return [GopassSecretProvider.gopass_get_repos(), self.use_show]
+
     @classmethod
     def __check_for_usable_gopass(cls) -> bool:
         if not GopassSecretProvider.__found_version:
@@ -110,9 +116,22 @@ class GopassSecretProvider(SecretsProvider):
         return repos
 
     def gopass_try_repos(self, log: Logger) -> subprocess.CompletedProcess:
+        repos = GopassSecretProvider.gopass_get_repos()
+        candidates = [Path(r).joinpath(self.path) for r in repos]
+
+        # Use the index to fetch the secret with a single targeted call
+        secret_path = GopassIndex.find(candidates, repos, log)
+        if secret_path is not None:
+            result = self.gopass_try(repo_path=secret_path, use_show=self.use_show, log=log)
+            if result and result.returncode == 0 and len(result.stdout.strip()) > 0:
+                return result
+
+            # The index is outdated i.e. the secret was moved or removed
+            log.debug(f'... gopass index is outdated for "{colors.bold(secret_path)}", probing all repos ...')
+            GopassIndex.invalidate()
+
         result = None
-        for repo in [Path(r) for r in GopassSecretProvider.gopass_get_repos()]:
-            secret_path = repo.joinpath(self.path)
+        for secret_path in candidates:
             result = self.gopass_try(repo_path=secret_path, use_show=self.use_show, log=log)
 
             # Stop on success
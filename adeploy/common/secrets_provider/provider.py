@@ -1,8 +1,10 @@
+import importlib
 import sys
 from abc import ABC, abstractmethod
 from typing import final
 
 from adeploy.common import colors
+from adeploy.common.errors import RenderError
 from adeploy.common.logging import get_logger
 
 class SecretsProvider(ABC):
@@ -15,6 +17,9 @@ class SecretsProvider(ABC):
 
     __created_secrets = {}
 
+    # Whether the value may be stored in the secrets cache, see --secrets-cache
+    cacheable: bool = False
+
     def __init__(self, name, log, ltrim: bool = False, rtrim: bool = False):
         if not log:
             self.log = get_logger()
@@ -38,6 +43,34 @@ class SecretsProvider(ABC):
         """
         return self.get_value()
 
+    def to_ref(self) -> dict:
+        """
+        Return a JSON serializable reference to this secret provider i.e. to store it in the secret manifest.
+        The reference contains the information needed to retrieve the secret value but no runtime state.
+        """
+        return {
+            'type': f'{self.__class__.__module__}.{self.__class__.__name__}',
+            'args': {k: v for k, v in self.__dict__.items() if k != 'log' and not k.startswith('_')},
+        }
+
+    @staticmethod
+    def from_ref(ref: dict, log=None) -> 'SecretsProvider':
+        """
+        Restore a secret provider from a reference created by to_ref().
+        The constructor is not called, so the secret is neither re-created nor registered again.
+        """
+        # Only restore secret providers of adeploy, as the type is taken from the secret manifest
+        module_name, _, class_name = str(ref.get('type')).rpartition('.')
+        cls = getattr(importlib.import_module(module_name), class_name, None) \
+            if module_name.startswith('adeploy.common.secrets_provider.') else None
+        if not isinstance(cls, type) or not issubclass(cls, SecretsProvider):
+            raise RenderError(f'Unsupported secrets provider "{colors.bold(ref.get("type"))}" in secret manifest, '
+                              f'please re-render.')
+        provider = cls.__new__(cls)
+        provider.__dict__.update(ref.get('args', {}))
+        provider.log = log if log else get_logger()
+        return provider
+
     @final
     def get_value(self, log=None) -> str:
         """
@@ -46,7 +79,7 @@ class SecretsProvider(ABC):
         """
         if not log:
             log = self.log
-        value = self._get_value(log)
+        value = self._get_cached_value(log)
         if self.ltrim:
             value = value.lstrip()
         else:
@@ -59,6 +92,25 @@ class SecretsProvider(ABC):
                 self.log.warning(f'"{colors.bold(self.get_id())}" returned trailing whitespace')
         return value
 
+    def _get_cached_value(self, log) -> str:
+        from adeploy.common.secrets_provider.cache import SecretsCache
+        if not self.cacheable or not SecretsCache.is_enabled():
+            return self._get_value(log)
+
+        source = self.__class__.__name__
+        scope = self.get_cache_scope()
+        value = SecretsCache.get(source, self.get_id(), log, scope)
+        if value is None:
+            value = self._get_value(log)
+            SecretsCache.set(source, self.get_id(), value, scope)
+        return value
+
+    def get_cache_scope(self) -> list:
+        """
+        Return the inputs other than the ID the secret value depends on, used to key the secrets cache.
+        """
+        return []
+
     @abstractmethod
     def _get_value(self, log) -> str:
         """
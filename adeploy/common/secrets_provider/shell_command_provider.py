@@ -1,3 +1,4 @@
+import os
 import subprocess
 import sys
 from logging import Logger
@@ -13,6 +14,9 @@ class ShellCommandSecretProvider(SecretsProvider):
     The command is executed upon first value access and the result is stored in memory.
     A ShellCommandSecretProvider object will return the same value for subsequent calls to get_value().
     """
+    __value = None
+    cacheable = True
+
     def __init__(self, command: str, log: Logger, ltrim: bool = False, rtrim: bool = False):
         self.__value = None
         if not command:
@@ -23,6 +27,10 @@ class ShellCommandSecretProvider(SecretsProvider):
     def get_id(self):
         return self.command
 
+    def get_cache_scope(self) -> list:
+        # Relative paths in the command depend on the working dir
+        return [os.getcwd()]
+
     def _get_value(self, log: Logger) -> str:
         if self.__value:
             return self.__value
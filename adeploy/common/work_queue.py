@@ -0,0 +1,86 @@
+import threading
+import time
+from logging import Logger
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from adeploy.common import colors
+
+
+class WorkQueue:
+    """
+    A debounced, coalescing work queue processed by a dedicated worker thread.
+    Jobs are identified by a key. Putting a job with a key that is already pending replaces the pending job and
+    restarts its debounce window, so that bursts of events i.e. from editors saving a file result in a single job.
+    If maxsize is set, putting a job with a new key blocks while the queue is full.
+    """
+
+    def __init__(self, handler: Callable[[Hashable, Any], None], log: Logger, debounce: float = 0.3,
+                 name: str = 'worker', maxsize: int = 0):
+        self.handler = handler
+        self.log = log
+        self.debounce = debounce
+        self.name = name
+        self.maxsize = maxsize
+        self.pending: Dict[Hashable, Tuple[float, Any]] = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        self.stopped = False
+        self.thread = threading.Thread(target=self.work, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def put(self, key: Hashable, value: Any = None):
+        with self.condition:
+            while self.maxsize and key not in self.pending and len(self.pending) >= self.maxsize and not self.stopped:
+                self.condition.wait()
+
+            # Re-insert to keep the order of the latest events
+            self.pending.pop(key, None)
+            self.pending[key] = (time.monotonic() + self.debounce, value)
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.pending = {}
+
+    def is_pending(self, key: Hashable) -> bool:
+        # A pending job supersedes a running job with the same key
+        with self.condition:
+            return key in self.pending
+
+    def next(self) -> Tuple[Hashable, Any]:
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                due = [k for k, (t, _) in self.pending.items() if t <= now]
+                if due:
+                    key = due[0]
+                    _, value = self.pending.pop(key)
+                    self.condition.notify_all()
+                    return key, value
+
+                timeout = min([t for t, _ in self.pending.values()], default=now + 3600) - now
+                self.condition.wait(timeout)
+
+        return None, None
+
+    def work(self):
+        while True:
+            key, value = self.next()
+            if self.stopped:
+                return
+
+            try:
+                self.handler(key, value)
+            except Exception as e:
+                self.log.error(colors.red(f'Unexpected error in {self.name} while processing {key}: {e}'))
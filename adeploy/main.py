@@ -13,6 +13,7 @@ from .common.errors import InputError, Error
 from .common.helpers import get_provider, get_submodules, get_providers
 from .common.logging import setup as setup_logging, get_logger
 from .common.kubectl import kubectl_init
+from .common.secrets_provider.cache import SecretsCache
 from .common.version import get_package_version
 
 log = get_logger('adeploy')
@@ -44,6 +45,9 @@ def main():
                 print("0.0.0")
                 sys.exit(1)
 
+        if args.purge_secrets_cache:
+            SecretsCache.purge(log)
+
         # Load renderer from provider
         provider = get_provider(args.provider)
 
@@ -1,3 +1,6 @@
+from .chart_cache import *
 from .helm import *
 from .helm_output import *
-from .helm_provider import *
\ No newline at end of file
+from .helm_release import *
+from .helm_provider import *
+from .hook_cache import *
\ No newline at end of file
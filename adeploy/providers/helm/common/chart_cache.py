@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+from logging import Logger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+import yaml
+
+from adeploy.common import colors
+from adeploy.common.helpers import get_dir_digest
+
+# Files that are modified per chart tree and thus must never be linked
+CHART_CACHE_COPY_FILES = ['Chart.yaml']
+
+
+def chart_cache_get_dir(adeploy_dir: str or Path) -> Path:
+    return Path(adeploy_dir).joinpath('helm').joinpath('charts')
+
+
+def chart_cache_get_ref(adeploy_dir: str or Path, repo_url: str, name: str, version: str) -> Path:
+    key = hashlib.sha256(f'{repo_url}\0{name}\0{version}'.encode()).hexdigest()
+    return chart_cache_get_dir(adeploy_dir).joinpath('refs').joinpath(f'{key}.json')
+
+
+def chart_cache_get(log: Logger, adeploy_dir: str or Path, repo_url: str, name: str,
+                    version: str) -> Optional[Path]:
+    """
+    Return the cached chart dir for the given repo URL, chart name and version or None if not cached.
+    """
+    ref_path = chart_cache_get_ref(adeploy_dir, repo_url, name, version)
+    try:
+        with open(ref_path, 'r') as fd:
+            digest = json.load(fd).get('digest')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    chart_path = chart_cache_get_dir(adeploy_dir).joinpath('objects').joinpath(str(digest))
+    if not chart_path.is_dir():
+        log.debug(f'... cached chart "{colors.bold(name)}" version {colors.bold(version)} is missing, '
+                  f'removing ref "{colors.bold(ref_path)}"')
+        ref_path.unlink(missing_ok=True)
+        return None
+
+    return chart_path
+
+
+def chart_cache_put(log: Logger, adeploy_dir: str or Path, repo_url: str, name: str, version: str,
+                    chart_dir: str or Path) -> Path:
+    """
+    Move the downloaded chart into the cache and reference it by repo URL, chart name and version.
+    Charts are stored by digest, so identical charts from different repos or versions are stored only once.
+    """
+    digest = get_dir_digest(chart_dir)
+    objects_dir = chart_cache_get_dir(adeploy_dir).joinpath('objects')
+    chart_path = objects_dir.joinpath(digest)
+
+    if not chart_path.is_dir():
+        objects_dir.mkdir(parents=True, exist_ok=True)
+
+        # Stage next to the final location to allow an atomic rename
+        staging = TemporaryDirectory(dir=objects_dir)
+        staging_path = Path(staging.name).joinpath(digest)
+        shutil.move(str(chart_dir), staging_path)
+
+        # Cached files are shared with the build dirs using hard links, so protect them from in-place changes
+        for root, _, files in os.walk(staging_path):
+            for file in files:
+                path = Path(root).joinpath(file)
+                path.chmod(path.stat().st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+        try:
+            os.rename(staging_path, chart_path)
+        except OSError:
+            # Already added by a concurrent run
+            pass
+
+        staging.cleanup()
+        log.debug(f'... added chart "{colors.bold(name)}" to cache "{colors.bold(chart_path)}"')
+
+    for ref_version in set([version, chart_cache_read_version(chart_path)]):
+        if not ref_version:
+            continue
+
+        ref_path = chart_cache_get_ref(adeploy_dir, repo_url, name, ref_version)
+        ref_path.parent.mkdir(parents=True, exist_ok=True)
+        ref_temp = ref_path.with_suffix('.tmp')
+        with open(ref_temp, 'w') as fd:
+            json.dump({'repo_url': repo_url, 'name': name, 'version': ref_version, 'digest': digest}, fd)
+        os.replace(ref_temp, ref_path)
+
+    return chart_path
+
+
+def chart_cache_read_version(chart_path: Path) -> Optional[str]:
+    try:
+        with open(chart_path.joinpath('Chart.yaml'), 'r') as fd:
+            version = yaml.load(fd, Loader=yaml.SafeLoader).get('version', None)
+            return str(version) if version is not None else None
+    except (OSError, AttributeError):
+        return None
+
+
+def chart_link_tree(chart_path: Path, dest: Path, link: bool = True):
+    """
+    Create a chart tree in dest from the given chart i.e. from the cache. Files are hard linked if possible and copied
+    otherwise i.e. if the chart is on a different device or if the files are going to be modified by hooks.
+    """
+
+    def copy_writable(src, dst):
+        shutil.copy2(src, dst)
+        os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)
+
+    def link_or_copy(src, dst):
+        if os.path.relpath(src, chart_path) in CHART_CACHE_COPY_FILES:
+            return copy_writable(src, dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            copy_writable(src, dst)
+
+    shutil.copytree(str(chart_path), str(dest), copy_function=link_or_copy if link else copy_writable)
@@ -1,12 +1,17 @@
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 from logging import Logger
 from pathlib import Path
 
 import yaml
 
-from adeploy.common.helpers import run_command
+from adeploy.common.helpers import get_file_stats, run_command
 from adeploy.common.deployment import Deployment
 from adeploy.common import colors
+from .chart_cache import chart_link_tree
 
 
 def helm_repo_add(log, repo, url):
@@ -24,75 +29,128 @@ def helm_repo_pull(log, repo, name, version, dest):
 
 def helm_template(log, deployment: Deployment, chart_path, values_path, skip_validate: bool = False,
                   skip_schema_validation: bool = False):
+    chart_path, chart_version = helm_prepare_chart(log, deployment, chart_path)
+
     args = (['template'] +
             (['--validate'] if not skip_validate else []) +
             (['--skip-schema-validation'] if skip_schema_validation else []) +
             [deployment.release, chart_path, '-n', deployment.namespace, '-f', values_path])
 
-    chart_version, old_app_version = helm_prepare_chart(log, deployment, chart_path)
-
     if chart_version:
         args += ['--version', chart_version]
 
-    result = helm(log, args)
-
-    if old_app_version:
-        helm_update_app_version(chart_path, old_app_version)
-
-    return result
+    return helm(log, args)
 
 
 def helm_install(log, deployment: Deployment, chart_path, values_path, dry_run=True,
                  skip_schema_validation: bool = False) -> subprocess.CompletedProcess:
+    chart_path, chart_version = helm_prepare_chart(log, deployment, chart_path)
+
     args = (['upgrade', '--install'] +
             (['--skip-schema-validation'] if skip_schema_validation else []) +
             [deployment.release, chart_path, '-n', deployment.namespace, '-f', values_path, '-o', 'json'])
 
-    chart_version, old_app_version = helm_prepare_chart(log, deployment, chart_path)
-
     if chart_version:
         args += ['--version', chart_version]
 
     if dry_run:
         args.append('--dry-run')
 
-    result = helm(log, args)
+    return helm(log, args)
 
-    if old_app_version:
-        helm_update_app_version(chart_path, old_app_version)
 
-    return result
+def helm_get_version(log) -> str:
+    return helm(log, ['version', '--short']).stdout.strip()
 
 
 def helm(log, args) -> subprocess.CompletedProcess:
     return run_command(log, ['helm'] + args)
 
 
-def helm_prepare_chart(log: Logger, deployment: Deployment, chart_path: Path) -> (str, str):
+def helm_prepare_chart(log: Logger, deployment: Deployment, chart_path: Path) -> (Path, str):
     chart = deployment.config.get('_chart', {})
     chart_version = chart.get('version', None)
     app_version = chart.get('appVersion', None)
 
-    old_app_version = None
-
     if app_version:
         log.debug(f'Using app version {colors.bold(app_version)} from defaults ...')
-        old_app_version = helm_update_app_version(chart_path, app_version)
+        chart_path = helm_get_chart_overlay(log, deployment, chart_path, app_version)
 
     if chart_version:
         log.debug(f'Using chart version {colors.bold(chart_version)} from defaults ...')
 
-    return chart_version, old_app_version
+    return chart_path, chart_version
+
+
+def helm_get_chart_overlay_dir(chart_path: Path) -> Path:
+    return Path(chart_path).parent.joinpath('.overlays')
+
+
+def helm_clean_chart_overlays(log: Logger, chart_path: Path):
+    """
+    Remove all overlays of the chart, i.e. of removed deployments or of a previous chart version.
+    """
+    for overlay_path in helm_get_chart_overlay_dir(chart_path).glob(f'*/*/{Path(chart_path).name}'):
+        log.debug(f'... removing chart overlay "{colors.bold(overlay_path)}"')
+        shutil.rmtree(overlay_path, ignore_errors=True)
+        helm_get_chart_overlay_stamp(overlay_path).unlink(missing_ok=True)
 
 
-def helm_update_app_version(chart_path: Path, app_version: str) -> str:
-    with open(str(chart_path.joinpath('Chart.yaml')), 'r+') as fd:
-        chart = yaml.load(fd.read(), Loader=yaml.FullLoader)
-        old_version = chart.get('appVersion', None)
-        chart['appVersion'] = app_version
+def helm_get_chart_overlay_stamp(overlay_path: Path) -> Path:
+    return overlay_path.with_name(f'{overlay_path.name}.stamp')
 
-        fd.seek(0)
+
+def helm_get_chart_stamp(chart_path: Path, app_version: str) -> str:
+    # Digest of the paths, mtimes and sizes of the chart files, this does not read the files
+    files = []
+    for root, dirs, names in os.walk(str(chart_path)):
+        files += [os.path.join(root, name) for name in names]
+    return hashlib.sha256(json.dumps({
+        'app_version': str(app_version),
+        'files': get_file_stats(files),
+    }, sort_keys=True).encode()).hexdigest()
+
+
+def helm_get_chart_overlay(log: Logger, deployment: Deployment, chart_path: Path, app_version: str) -> Path:
+    """
+    Return a chart tree for the deployment that uses the given app version. The shared chart is never modified.
+    Instead, a per-deployment overlay is created that hard links the chart files and has a private Chart.yaml.
+    The overlay is reused as long as the chart and the app version are unchanged.
+    """
+    chart_path = Path(chart_path)
+    with open(chart_path.joinpath('Chart.yaml'), 'r') as fd:
+        chart = yaml.load(fd, Loader=yaml.FullLoader)
+
+    if str(chart.get('appVersion', None)) == str(app_version):
+        return chart_path
+
+    overlay_path = helm_get_chart_overlay_dir(chart_path) \
+        .joinpath(deployment.namespace) \
+        .joinpath(deployment.release) \
+        .joinpath(chart_path.name)
+
+    stamp_path = helm_get_chart_overlay_stamp(overlay_path)
+    stamp = helm_get_chart_stamp(chart_path, app_version)
+    try:
+        if overlay_path.is_dir() and stamp_path.read_text() == stamp:
+            log.debug(f'... using chart overlay in "{colors.bold(overlay_path)}"')
+            return overlay_path
+    except OSError:
+        pass
+
+    log.debug(f'... creating chart overlay in "{colors.bold(overlay_path)}"')
+
+    stamp_path.unlink(missing_ok=True)
+    if overlay_path.exists():
+        shutil.rmtree(overlay_path)
+
+    chart_link_tree(chart_path, overlay_path)
+
+    chart['appVersion'] = app_version
+    with open(overlay_path.joinpath('Chart.yaml'), 'w') as fd:
         yaml.dump(chart, fd)
-        fd.truncate()
 
-    return old_version
+    # Written last, so that an incomplete overlay is never reused
+    stamp_path.write_text(stamp)
+
+    return overlay_path
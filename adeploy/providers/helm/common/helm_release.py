@@ -0,0 +1,87 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+from logging import Logger
+from typing import Dict
+
+import yaml
+
+from adeploy.common import colors
+from adeploy.common.kubectl import kubectl_get_secrets
+
+
+class HelmRelease:
+    """
+    A deployed Helm release decoded from the secret Helm uses to store releases.
+    """
+
+    name: str = None
+    namespace: str = None
+    version: int = None
+    manifest: str = None
+    config: dict = None
+    chart_version: str = None
+    app_version: str = None
+
+    def __init__(self, release: dict):
+        self.name = release.get('name')
+        self.namespace = release.get('namespace')
+        self.version = release.get('version')
+        self.manifest = release.get('manifest', '')
+        self.config = release.get('config') or {}
+
+        metadata = (release.get('chart') or {}).get('metadata') or {}
+        self.chart_version = metadata.get('version')
+        self.app_version = metadata.get('appVersion')
+
+    @staticmethod
+    def decode(data: str) -> dict:
+        # Helm stores the release as base64 encoded gzipped JSON which is base64 encoded again by k8s
+        release = base64.b64decode(base64.b64decode(data))
+        if release[:2] == b'\x1f\x8b':
+            release = gzip.decompress(release)
+        return json.loads(release)
+
+    def get_digest(self) -> str:
+        return helm_get_release_digest(self.manifest, self.config, self.chart_version, self.app_version)
+
+
+def helm_get_release_digest(manifest: str, values: dict, chart_version: str, app_version: str) -> str:
+    # Compare the parsed objects to ignore formatting. Hooks are not part of the release manifest.
+    objects = []
+    for obj in yaml.load_all(manifest, Loader=yaml.SafeLoader):
+        if not obj or 'helm.sh/hook' in ((obj.get('metadata') or {}).get('annotations') or {}):
+            continue
+        objects.append(json.dumps(obj, sort_keys=True, default=str))
+
+    return hashlib.sha256(json.dumps({
+        'manifest': sorted(objects),
+        'values': values or {},
+        'chart_version': str(chart_version),
+        'app_version': str(app_version),
+    }, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def helm_get_deployed_releases(log: Logger, namespace: str) -> Dict[str, HelmRelease]:
+    """
+    Return all deployed Helm releases of the namespace using a single request.
+    """
+    driver = os.getenv('HELM_DRIVER', 'secret')
+    if driver not in ['secret', 'secrets']:
+        log.debug(f'... cannot get deployed releases from Helm storage driver "{colors.bold(driver)}"')
+        return {}
+
+    releases = {}
+    for secret in kubectl_get_secrets(log, namespace, selector='owner=helm,status=deployed'):
+        # Skip releases that cannot be decoded, these are upgraded
+        try:
+            release = HelmRelease(HelmRelease.decode(secret.get('data', {}).get('release', '')))
+        except (ValueError, OSError, EOFError) as e:
+            log.debug(f'... cannot decode Helm release secret '
+                      f'"{colors.bold(secret.get("metadata", {}).get("name"))}": {e}')
+            continue
+        releases[release.name] = release
+
+    return releases
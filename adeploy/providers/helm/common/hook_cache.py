@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import shutil
+from logging import Logger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+from adeploy.common import colors
+
+
+def hook_cache_get_dir(adeploy_dir: str or Path) -> Path:
+    return Path(adeploy_dir).joinpath('helm').joinpath('hooks')
+
+
+def hook_cache_get_key(hooks_digest: str, hook_name: str, chart_files: dict) -> str:
+    """
+    Return the cache key of a hook run from the digest of the hooks dir, the hook name and the input chart files.
+    """
+    return hashlib.sha256(json.dumps({
+        'hooks': hooks_digest,
+        'hook': hook_name,
+        'chart': chart_files,
+    }, sort_keys=True).encode()).hexdigest()
+
+
+def hook_cache_replay(log: Logger, adeploy_dir: str or Path, key: str, chart_dir: Path,
+                      chart_files: dict) -> Optional[dict]:
+    """
+    Apply the cached changes of a hook run to the chart dir. Returns the resulting chart files or None if not cached.
+    """
+    entry_dir = hook_cache_get_dir(adeploy_dir).joinpath(key)
+    try:
+        with open(entry_dir.joinpath('delta.json'), 'r') as fd:
+            delta = json.load(fd)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    for path in delta.get('deleted', []):
+        chart_dir.joinpath(path).unlink(missing_ok=True)
+
+    for path in delta.get('changed', {}).keys():
+        dest = chart_dir.joinpath(path)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.unlink(missing_ok=True)
+        shutil.copy2(entry_dir.joinpath('files').joinpath(path), dest)
+
+    log.debug(f'... {delta.get("stdout", "")}')
+
+    files = {p: d for p, d in chart_files.items() if p not in delta.get('deleted', [])}
+    files.update(delta.get('changed', {}))
+    return files
+
+
+def hook_cache_put(log: Logger, adeploy_dir: str or Path, key: str, chart_dir: Path, old_files: dict,
+                   new_files: dict, stdout: str = None):
+    """
+    Store the changes of a hook run i.e. the changed and deleted files of the chart dir.
+    """
+    cache_dir = hook_cache_get_dir(adeploy_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    delta = {
+        'deleted': sorted([p for p in old_files.keys() if p not in new_files]),
+        'changed': {p: d for p, d in new_files.items() if old_files.get(p) != d},
+        'stdout': stdout,
+    }
+
+    # Stage next to the final location to allow an atomic rename
+    staging = TemporaryDirectory(dir=cache_dir)
+    staging_path = Path(staging.name).joinpath(key)
+    for path in delta['changed'].keys():
+        dest = staging_path.joinpath('files').joinpath(path)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(chart_dir.joinpath(path), dest)
+
+    staging_path.mkdir(parents=True, exist_ok=True)
+    with open(staging_path.joinpath('delta.json'), 'w') as fd:
+        json.dump(delta, fd)
+
+    entry_dir = cache_dir.joinpath(key)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.rename(staging_path, entry_dir)
+    except OSError:
+        # Already added by a concurrent run
+        pass
+
+    staging.cleanup()
+    log.debug(f'... cached {colors.bold(len(delta["changed"]))} changed and '
+              f'{colors.bold(len(delta["deleted"]))} deleted files in "{colors.bold(entry_dir)}"')
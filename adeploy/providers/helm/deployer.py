@@ -1,14 +1,21 @@
 import argparse
 from pathlib import Path
 from subprocess import CalledProcessError
+from typing import Dict, Optional
+
+import yaml
 
 from adeploy.common import colors
+from adeploy.common.deployment import Deployment
 from adeploy.common.errors import DeployError
-from adeploy.providers.helm.common import helm_install, HelmOutput, HelmProvider, get_defaults
+from adeploy.providers.helm.common import helm_install, helm_get_deployed_releases, helm_get_release_digest, \
+    HelmOutput, HelmProvider, HelmRelease, get_defaults
 
 
 class Deployer(HelmProvider):
     skip_schema_validation: bool
+    releases: Dict[str, Dict[str, HelmRelease]] = None
+    config_cache = True
 
     @staticmethod
     def get_parser():
@@ -26,36 +33,85 @@ class Deployer(HelmProvider):
         chart_defaults = get_defaults(self.get_defaults_file(), log=self.log).get('_chart', {})
         self.name = chart_defaults.get('name', self.name)
         self.skip_schema_validation = args.get('skip_schema_validation')
+        self.releases = {}
+
+    def get_local_digest(self, deployment: Deployment, manifests_dir: Path) -> str:
+        with open(manifests_dir.joinpath('manifest.yml')) as fd:
+            manifest = fd.read()
+        with open(manifests_dir.joinpath('values.yml')) as fd:
+            values = yaml.load(fd, Loader=yaml.SafeLoader)
+        with open(self.get_chart_dir().joinpath('Chart.yaml')) as fd:
+            chart = yaml.load(fd, Loader=yaml.SafeLoader)
+
+        app_version = deployment.config.get('_chart', {}).get('appVersion', chart.get('appVersion'))
+        return helm_get_release_digest(manifest, values, chart.get('version'), app_version)
+
+    def get_deployed_release(self, deployment: Deployment) -> Optional[HelmRelease]:
+        if deployment.namespace not in self.releases:
+            try:
+                self.releases[deployment.namespace] = helm_get_deployed_releases(self.log, deployment.namespace)
+            except CalledProcessError as e:
+                self.log.warning(colors.orange(f'... cannot get deployed releases in namespace '
+                                               f'"{colors.bold(deployment.namespace)}": {e.stderr.strip()}'))
+                self.releases[deployment.namespace] = {}
+
+        return self.releases[deployment.namespace].get(deployment.release)
+
+    def get_unchanged_release(self, deployment: Deployment, manifests_dir: Path) -> Optional[HelmRelease]:
+        release = self.get_deployed_release(deployment)
+        if not release:
+            return None
+
+        # If the releases cannot be compared i.e. if not rendered yet, the upgrade reports the actual error
+        try:
+            return release if release.get_digest() == self.get_local_digest(deployment, manifests_dir) else None
+        except (OSError, ValueError, TypeError, yaml.YAMLError) as e:
+            self.log.debug(f'... cannot compare deployed release "{colors.bold(release.name)}", upgrading: {e}')
+            return None
 
     def run(self):
 
         self.log.debug(f'Working on deployment "{self.name}" ...')
 
         for deployment in self.load_deployments():
+            self.deploy_deployment(deployment)
 
-            self.log.info(f'Deploying Helm chart "{colors.blue(deployment)}" ...')
-            if not self.verify_current_cluster_is_last_cluster(deployment):
-                continue
-            try:
-                values_path = Path(self.build_dir) \
-                    .joinpath(deployment.namespace) \
-                    .joinpath(self.name) \
-                    .joinpath(deployment.release) \
-                    .joinpath(f'values.yml')
-
-                result = HelmOutput(
-                    helm_install(self.log, deployment, self.get_chart_dir(), str(values_path), dry_run=False,
-                                 skip_schema_validation=self.skip_schema_validation).stdout)
-
-                is_update = result.first_deployed != result.last_deployed
-                last_update = f', last deployed {colors.bold(result.last_deployed)}' if is_update else ''
-                is_success = result.status == 'deployed'
-
-                self.log.info(f'... '
-                              f'Chart version {colors.bold(result.chart_version)}, '
-                              f'app version {colors.bold(result.app_version)}{last_update}: '
-                              f'{colors.green_bold(result.description)}, '
-                              f'status {colors.green_bold(result.status) if is_success else colors.red_bold(result.status)}')
-                self.save_current_cluster_as_last_cluster(deployment)
-            except CalledProcessError as e:
-                raise DeployError(f'Error while deploying chart "{self.name}": {e.stderr}')
+    def deploy_deployment(self, deployment: Deployment):
+
+        self.log.info(f'Deploying Helm chart "{colors.blue(deployment)}" ...')
+        if not self.verify_current_cluster_is_last_cluster(deployment):
+            return
+        try:
+            manifests_dir = Path(self.build_dir) \
+                .joinpath(deployment.namespace) \
+                .joinpath(self.name) \
+                .joinpath(deployment.release)
+            values_path = manifests_dir.joinpath(f'values.yml')
+
+            # Skip the upgrade if the deployed release equals the rendered release
+            if not self.args.force:
+                release = self.get_unchanged_release(deployment, manifests_dir)
+                if release:
+                    self.log.info(f'... '
+                                  f'Release revision {colors.bold(release.version)} is up to date, '
+                                  f'chart version {colors.bold(release.chart_version)}, '
+                                  f'app version {colors.bold(release.app_version)}: '
+                                  f'{colors.gray("unchanged")}. Pass --force to upgrade anyways.')
+                    return
+
+            result = HelmOutput(
+                helm_install(self.log, deployment, self.get_chart_dir(), str(values_path), dry_run=False,
+                             skip_schema_validation=self.skip_schema_validation).stdout)
+
+            is_update = result.first_deployed != result.last_deployed
+            last_update = f', last deployed {colors.bold(result.last_deployed)}' if is_update else ''
+            is_success = result.status == 'deployed'
+
+            self.log.info(f'... '
+                          f'Chart version {colors.bold(result.chart_version)}, '
+                          f'app version {colors.bold(result.app_version)}{last_update}: '
+                          f'{colors.green_bold(result.description)}, '
+                          f'status {colors.green_bold(result.status) if is_success else colors.red_bold(result.status)}')
+            self.save_current_cluster_as_last_cluster(deployment)
+        except CalledProcessError as e:
+            raise DeployError(f'Error while deploying chart "{self.name}": {e.stderr}')
@@ -1,17 +1,27 @@
 import argparse
 import glob
+import hashlib
+import json
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
 from pathlib import Path
 from subprocess import CalledProcessError
 from tempfile import TemporaryDirectory
+from typing import List
 
 import yaml
 
 from adeploy.common import colors
+from adeploy.common.deployment import Deployment
+from adeploy.common.logging import BufferedLogger
 from adeploy.common.errors import RenderError
-from .common import helm_repo_add, helm_repo_pull, helm_template, HelmProvider, get_defaults
+from adeploy.common.helpers import get_dir_digest, get_file_digests
+from .common import helm_repo_add, helm_repo_pull, helm_template, helm_get_version, HelmProvider, get_defaults, \
+    chart_cache_get, chart_cache_put, chart_cache_read_version, chart_link_tree, hook_cache_get_key, hook_cache_put, \
+    hook_cache_replay, helm_clean_chart_overlays
 
 
 class Renderer(HelmProvider):
@@ -20,6 +30,12 @@ class Renderer(HelmProvider):
     hooks_dir: Path = None
     skip_validate: bool = False
     skip_schema_validation: bool = False
+    jobs: int = 1
+    no_cache: bool = False
+    chart_version: str = None
+    chart_digest: str = None
+    helm_version: str = None
+    resolved_chart_version: str = None
 
     @staticmethod
     def get_parser():
@@ -46,6 +62,13 @@ class Renderer(HelmProvider):
                             help='Directory containing bash scripts that can be used to modify the Helm chart without'
                                  'changing upstream repos')
 
+        parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                            help='Number of deployments to render concurrently using "helm template"')
+
+        parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                            help='Render all deployments even if their chart and values are unchanged since the last '
+                                 'render and run all hooks instead of replaying their cached changes.')
+
         return parser
 
     def parse_args(self, args: dict):
@@ -65,11 +88,16 @@ class Renderer(HelmProvider):
 
         self.skip_validate = args.get('skip_validate')
         self.skip_schema_validation = args.get('skip_schema_validation')
+        self.jobs = max(args.get('jobs') or 1, 1)
+        self.no_cache = args.get('no_cache', False)
 
     def build_chart(self):
 
         chart_build_dir = self.get_chart_dir()
 
+        # Overlays are created from the chart build dir when needed, so outdated overlays can be removed
+        helm_clean_chart_overlays(self.log, chart_build_dir)
+
         try:
 
             # Chart dir exists, copy to build dir
@@ -96,33 +124,50 @@ class Renderer(HelmProvider):
                                       f'in the namespace configuration or '
                                       f'specify a chart repo URL using --repo-url to download the chart repo.')
 
-                self.log.info(f'Adding chart repo from {colors.blue(self.repo_url)} ...')
-
                 if chart_build_dir.exists():
                     shutil.rmtree(chart_build_dir)
 
-                repo = f'repo_{self.name}'
+                # Pinned chart versions are taken from the chart cache without accessing the chart repo
+                chart_version = self.get_chart_version() or self.resolved_chart_version
+                chart_path = chart_cache_get(self.log, self.args.adeploy_dir, self.repo_url, self.name,
+                                             chart_version) if chart_version else None
 
-                try:
-                    self.log.debug(helm_repo_add(self.log, repo, self.repo_url).stdout.strip())
-                except CalledProcessError as e:
-                    raise RenderError(f'Error while adding helm repo {self.repo_url}: {e.stderr}')
+                if chart_path:
+                    self.log.info(f'Using cached chart "{colors.bold(self.name)}" version '
+                                  f'{colors.bold(chart_version)} from {colors.blue(self.repo_url)} ...')
 
-                try:
+                else:
+                    self.log.info(f'Adding chart repo from {colors.blue(self.repo_url)} ...')
 
-                    chart_version = self.get_chart_version()
-                    self.log.debug(f'Pulling chart "{colors.bold(self.name)}" version {colors.bold(chart_version)} ...')
+                    repo = f'repo_{self.name}'
 
-                    temp = TemporaryDirectory()
-                    self.log.debug(helm_repo_pull(self.log, repo,
-                                                  name=self.name,
-                                                  version=chart_version,
-                                                  dest=temp.name).stdout.strip())
+                    try:
+                        self.log.debug(helm_repo_add(self.log, repo, self.repo_url).stdout.strip())
+                    except CalledProcessError as e:
+                        raise RenderError(f'Error while adding helm repo {self.repo_url}: {e.stderr}')
 
-                    shutil.move(f'{temp.name}/{self.name}', chart_build_dir)
+                    try:
 
-                except CalledProcessError as e:
-                    raise RenderError(f'Error while pulling helm repo {self.repo_url}: {e.stderr}')
+                        self.log.debug(f'Pulling chart "{colors.bold(self.name)}" '
+                                       f'version {colors.bold(chart_version)} ...')
+
+                        temp = TemporaryDirectory()
+                        self.log.debug(helm_repo_pull(self.log, repo,
+                                                      name=self.name,
+                                                      version=chart_version,
+                                                      dest=temp.name).stdout.strip())
+
+                        chart_path = chart_cache_put(self.log, self.args.adeploy_dir, self.repo_url, self.name,
+                                                     chart_version, f'{temp.name}/{self.name}')
+
+                        # Re-use the pulled version on subsequent builds i.e. in watch mode
+                        self.resolved_chart_version = chart_cache_read_version(chart_path)
+
+                    except CalledProcessError as e:
+                        raise RenderError(f'Error while pulling helm repo {self.repo_url}: {e.stderr}')
+
+                # Hooks might modify chart files in place, so only link the cached files if there are no hooks
+                chart_link_tree(chart_path, chart_build_dir, link=not self.hooks_dir.is_dir())
 
         except shutil.Error as e:
             raise RenderError(f'Error while creating chart build dir "{chart_build_dir}": {e.strerror}')
@@ -130,10 +175,25 @@ class Renderer(HelmProvider):
     def run_hooks(self):
 
         if self.hooks_dir.is_dir():
-            for hook in [Path(h) for h in glob.glob(f'{self.hooks_dir}/*.sh')]:
+
+            chart_dir = self.src_dir.joinpath(self.get_chart_dir())
+            hooks_digest = get_dir_digest(self.hooks_dir)
+            chart_files = get_file_digests(chart_dir)
+
+            for hook in sorted([Path(h) for h in glob.glob(f'{self.hooks_dir}/*.sh')]):
+
+                # Replay the changes of a previous run with the same hooks and input chart
+                key = hook_cache_get_key(hooks_digest, hook.name, chart_files)
+                if not self.no_cache:
+                    files = hook_cache_replay(self.log, self.args.adeploy_dir, key, chart_dir, chart_files)
+                    if files is not None:
+                        self.log.info(f'Replaying cached hook "{colors.bold(hook.stem)}" ...')
+                        chart_files = files
+                        continue
+
                 self.log.info(f'Running hook "{colors.bold(hook.stem)}" ...')
 
-                cmd = [str(c) for c in [hook, self.src_dir.joinpath(self.get_chart_dir())]]
+                cmd = [str(c) for c in [hook, chart_dir]]
 
                 self.log.debug(f'... Executing command "{colors.bold(" ".join(cmd))}" '
                                f'in "{colors.bold(self.hooks_dir)}"')
@@ -147,35 +207,132 @@ class Renderer(HelmProvider):
                     self.log.error(colors.red(f'Error when running hook "{colors.bold(hook.stem)}": {e.stderr}'))
                     raise e
 
-    def run(self):
+                files = get_file_digests(chart_dir)
+                hook_cache_put(self.log, self.args.adeploy_dir, key, chart_dir, chart_files, files, result.stdout)
+                chart_files = files
+
+    def get_render_digest(self, deployment: Deployment, values: str, chart_version: str, chart_digest: str,
+                          helm_version: str) -> str:
+        return hashlib.sha256(json.dumps({
+            'values': values,
+            'chart': chart_digest,
+            'chart_version': chart_version,
+            'helm_version': helm_version,
+            'release': deployment.release,
+            'namespace': deployment.namespace,
+            'skip_validate': self.skip_validate,
+            'skip_schema_validation': self.skip_schema_validation,
+            # Validation and lookups depend on the current cluster
+            'cluster': self.current_cluster if not self.skip_validate else None,
+        }, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def get_digest_path(deployment: Deployment) -> Path:
+        return deployment.manifests_dir.joinpath('manifest.digest')
+
+    @staticmethod
+    def is_unchanged(deployment: Deployment, digest: str) -> bool:
+        if not deployment.manifests_dir.joinpath('manifest.yml').is_file():
+            return False
+        try:
+            return Renderer.get_digest_path(deployment).read_text().strip() == digest
+        except FileNotFoundError:
+            return False
+
+    def render_deployment(self, deployment: Deployment, values: str, chart_version: str, digest: str,
+                          log: Logger or BufferedLogger):
+
+        log.info(f'Rendering chart "{colors.bold(self.name)}" '
+                 f'version {colors.bold(chart_version)} '
+                 f'and values for deployment "{colors.blue(deployment)}" '
+                 f'in "{colors.bold(deployment.manifests_dir)}" ...')
+
+        try:
+
+            deployment.manifests_dir.mkdir(parents=True, exist_ok=True)
+            values_path = f'{deployment.manifests_dir}/values.yml'
+            with open(values_path, 'w') as fd:
+                fd.write(values)
+
+            output = helm_template(log, deployment, self.get_chart_dir(), values_path,
+                                   skip_validate=self.skip_validate,
+                                   skip_schema_validation=self.skip_schema_validation)
+            with open(f'{deployment.manifests_dir}/manifest.yml', 'w') as fd:
+                fd.write(output.stdout)
+
+            # Store the digest last, so that failed renderings are never skipped
+            self.get_digest_path(deployment).write_text(digest)
+
+        except CalledProcessError as e:
+            raise RenderError(f'Error while rendering chart "{self.name}": {e.stderr}')
+
+    def prepare_chart(self):
 
-        self.log.debug(f'Working on deployment "{self.name}" ...')
         self.build_chart()
         self.run_hooks()
 
-        for deployment in self.load_deployments():
+        self.chart_version = self.get_chart_version()
+        self.chart_digest = get_dir_digest(self.get_chart_dir())
+
+        try:
+            self.helm_version = helm_get_version(self.log)
+        except CalledProcessError as e:
+            raise RenderError(f'Error while getting helm version: {e.stderr}')
 
-            self.log.debug(f'Clean build dirs: {", ".join([colors.bold(d) for d in deployment.clean_build_dir()])}')
+    def render_deployments(self, deployments: List[Deployment]) -> List[Deployment]:
 
-            self.log.info(f'Rendering chart "{colors.bold(self.name)}" '
-                          f'version {colors.bold(self.get_chart_version())} '
-                          f'and values for deployment "{colors.blue(deployment)}" '
-                          f'in "{colors.bold(deployment.manifests_dir)}" ...')
+        jobs = []
+        for deployment in deployments:
 
-            try:
+            values = yaml.dump(deployment.config)
+            digest = self.get_render_digest(deployment, values, self.chart_version, self.chart_digest,
+                                            self.helm_version)
+            unchanged = not self.no_cache and self.is_unchanged(deployment, digest)
 
-                deployment.manifests_dir.mkdir(parents=True, exist_ok=True)
-                values_path = f'{deployment.manifests_dir}/values.yml'
-                with open(values_path, 'w') as fd:
-                    yaml.dump(deployment.config, fd)
+            self.log.debug(f'Clean build dirs: '
+                           f'{", ".join([colors.bold(d) for d in deployment.clean_build_dir(keep_manifests=unchanged)])}')
 
-                output = helm_template(self.log, deployment, self.get_chart_dir(), values_path,
-                                       skip_validate=self.skip_validate,
-                                       skip_schema_validation=self.skip_schema_validation)
-                with open(f'{deployment.manifests_dir}/manifest.yml', 'w') as fd:
-                    fd.write(output.stdout)
+            if unchanged:
+                self.log.info(f'Skipping deployment "{colors.blue(deployment)}", chart and values are unchanged. '
+                              f'Pass --no-cache to render anyways.')
+                continue
 
-            except CalledProcessError as e:
-                raise RenderError(f'Error while rendering chart "{self.name}": {e.stderr}')
+            jobs.append((deployment, values, self.chart_version, digest))
+
+        if self.jobs <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                self.render_deployment(*job, self.log)
+            return [job[0] for job in jobs]
+
+        self.log.debug(f'Rendering {colors.bold(len(jobs))} deployments using {colors.bold(self.jobs)} jobs ...')
+
+        # Run helm template concurrently but emit the buffered messages in the order of the deployments
+        logs = [BufferedLogger(self.log) for _ in jobs]
+        error = None
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self.render_deployment, *job, log) for job, log in zip(jobs, logs)]
+
+            # Wait for all jobs and report the errors of all deployments, but raise the first one
+            for job, future, log in zip(jobs, futures, logs):
+                try:
+                    future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+                    else:
+                        log.error(colors.red(f'Error rendering deployment "{colors.blue(job[0])}": {e}'))
+                finally:
+                    log.flush()
+
+        if error:
+            raise error
+
+        return [job[0] for job in jobs]
+
+    def run(self):
+
+        self.log.debug(f'Working on deployment "{self.name}" ...')
+        self.prepare_chart()
+        self.render_deployments(self.load_deployments())
 
         return True
@@ -1,15 +1,16 @@
 import argparse
-import json
-import os
-import tempfile
 from pathlib import Path
 from subprocess import CalledProcessError
+from typing import List
 
 import yaml
+from yaml.parser import ParserError
 from yaml.scanner import ScannerError
 
 from adeploy.common import colors
-from adeploy.common.kubectl import kubectl_apply, parse_kubectrl_apply
+from adeploy.common.deployment import Deployment
+from adeploy.common.kubectl import kubectl_apply_manifests, kubectl_get_namespaces, kubectl_list, \
+    parse_kubectrl_apply
 from adeploy.common.errors import TestError
 from adeploy.providers.helm.common import helm_install, HelmOutput, HelmProvider, get_defaults
 
@@ -17,6 +18,8 @@ from adeploy.providers.helm.common import helm_install, HelmOutput, HelmProvider
 class Tester(HelmProvider):
     skip_raw_test: bool
     skip_schema_validation: bool
+    namespaces: List[str] = None
+    config_cache = True
 
     @staticmethod
     def get_parser():
@@ -41,119 +44,96 @@ class Tester(HelmProvider):
         chart_defaults = get_defaults(self.get_defaults_file(), log=self.log).get('_chart', {})
         self.name = chart_defaults.get('name', self.name)
 
+    def get_namespaces(self) -> List[str]:
+        if self.namespaces is None:
+            self.namespaces = kubectl_get_namespaces(self.log)
+        return self.namespaces
+
+    def test_raw_manifests(self, deployment: Deployment, manifest_path: Path):
+
+        try:
+            with open(manifest_path) as fd:
+                manifests = [m for m in yaml.load_all(fd, Loader=yaml.FullLoader) if m]
+        except (ScannerError, ParserError) as e:
+            raise TestError(f'Error when loading YAML file "{manifest_path}": {e}')
+
+        # Group manifests by the namespace to pass to kubectl:
+        # - Cluster resources do not need a namespace
+        # - Namespace is defined in manifest or there are manifests for different namespaces, so don't pass it
+        # - Namespace is not defined in manifest (which is best practice), so pass the release namespace
+        groups = {}
+        for manifest in manifests:
+            kind = manifest.get('kind') or ''
+            namespace = (manifest.get('metadata') or {}).get('namespace', False)
+            target_namespace = None if 'cluster' in kind.lower() or namespace else deployment.namespace
+            groups.setdefault(target_namespace, []).append(manifest)
+
+        # Dry-run each group in a single request from memory
+        for target_namespace, items in groups.items():
+            try:
+                result = kubectl_apply_manifests(self.log, items, namespace=target_namespace, dry_run='server')
+                stdout = result.stdout
+
+            except CalledProcessError as e:
+                self.log.warning(colors.orange(f' ... '
+                                               f'Error when dry-running kubectl apply '
+                                               f'using raw manifests: '
+                                               f'{e.stderr[:255] + (e.stderr[255:] and "...")}'))
+
+                self.log.warning(f'Helm install might work anyways, so ignore and continue.')
+
+                # Show the resources that passed anyways
+                stdout = e.stdout or ''
+
+            parse_kubectrl_apply(self.log, stdout, manifests=kubectl_list(items),
+                                 deployment_ns=deployment.namespace, prefix=2 * '...',
+                                 namespaces=self.get_namespaces())
+
     def run(self):
 
         self.log.debug(f'Working on deployment "{self.name}" ...')
 
         for deployment in self.load_deployments():
+            self.test_deployment(deployment)
 
-            self.log.info(f'Testing Helm deployment "{colors.blue(deployment)}" ...')
+    def test_deployment(self, deployment: Deployment):
 
-            try:
-                values_path = Path(self.build_dir) \
-                    .joinpath(deployment.namespace) \
-                    .joinpath(self.name) \
-                    .joinpath(deployment.release) \
-                    .joinpath(f'values.yml')
-
-                result = HelmOutput(
-                    helm_install(self.log, deployment, self.get_chart_dir(), str(values_path), dry_run=True,
-                                 skip_schema_validation=self.skip_schema_validation).stdout)
-
-                is_update = result.first_deployed != result.last_deployed
-                last_update = f', last deployed {colors.bold(result.last_deployed)}' if is_update else ''
-                is_success = result.status == 'pending-upgrade' or result.status == 'pending-install'
-
-                self.log.info(f'... '
-                              f'Chart version {colors.bold(result.chart_version)}, '
-                              f'app version {colors.bold(result.app_version)}{last_update}: '
-                              f'{colors.green_bold(result.description)}, '
-                              f'status {colors.green_bold(result.status) if is_success else colors.red_bold(result.status)}')
-
-                if self.skip_raw_test:
-                    self.log.info(f'Skip testing of raw manifests.')
-                    continue
-
-                manifest_path = Path(self.build_dir) \
-                    .joinpath(deployment.namespace) \
-                    .joinpath(self.name) \
-                    .joinpath(deployment.release) \
-                    .joinpath(f'manifest.yml')
-
-                # Test to apply via kubectl and server-dry-run
-                self.log.info(f'... Testing raw manifests from "{colors.bold(manifest_path)}" (may fail) ...')
-                manifest_files = []
-                cur_manifest_file = None
-                keep_files = []
-                try:
-                    # Split manifest into single resources ...
-                    with open(manifest_path) as fd_in:
-                        for manifest in fd_in.read().split('---\n'):
-                            if len(manifest.replace('\n', '').strip()) > 0:
-                                fd_out = tempfile.NamedTemporaryFile(delete=False, mode='w')
-                                fd_out.write(manifest)
-                                fd_out.close()
-                                manifest_files.append(fd_out.name)
-
-                    for single_manifest_path in manifest_files:
-
-                        # Determine destination namespace
-                        cur_manifest_file = single_manifest_path
-                        with open(single_manifest_path) as fd:
-                            manifest_yaml = yaml.load(fd, Loader=yaml.FullLoader)
-
-                        # Skip empty YAML i.e. comments
-                        if not manifest_yaml:
-                            continue
-
-                        kind = manifest_yaml.get('kind')
-                        namespace = manifest_yaml.get('metadata', {}).get('namespace', False)
-
-                        # Cluster resource does not need a namespace
-                        if 'cluster' in kind.lower():
-
-                            manifests = kubectl_apply(self.log, single_manifest_path, dry_run='client', output='json')
-                            result = kubectl_apply(self.log, single_manifest_path, dry_run='server')
-
-                        # Namespace is not defined in manifest (which is best practice), so pass it to kubectl
-                        elif not namespace:
-
-                            manifests = kubectl_apply(self.log, single_manifest_path, namespace=deployment.namespace,
-                                                      dry_run='client', output='json')
-                            result = kubectl_apply(self.log, single_manifest_path, namespace=deployment.namespace,
-                                                   dry_run='server')
-
-                        # Namespace is defined in manifest or there are manifests for different namespaces,
-                        # so don't pass it to kubectl
-                        else:
-
-                            manifests = kubectl_apply(self.log, single_manifest_path, dry_run='client', output='json')
-                            result = kubectl_apply(self.log, single_manifest_path, dry_run='server')
-
-                        parse_kubectrl_apply(self.log, result.stdout, manifests=json.loads(manifests.stdout),
-                                             deployment_ns=deployment.namespace, prefix=2 * '...')
-
-                except CalledProcessError as e:
-                    self.log.warning(colors.orange(f' ... '
-                                                   f'Error when dry-running kubectl apply '
-                                                   f'using raw manifests: '
-                                                   f'{e.stderr[:255] + (e.stderr[255:] and "...")}'))
-
-                    self.log.warning(f'Helm install might work anyways, so ignore and continue.')
-                    pass
-
-                except ScannerError as e:
-                    keep_files.append(cur_manifest_file)  # Keep file for debugging purpose.
-                    raise TestError(f'Error when loading YAML file "{cur_manifest_file}": {e}')
-
-                # Clean up
-                finally:
-                    for path in manifest_files:
-                        if path in keep_files:
-                            self.log.warning(
-                                f'Keeping temporary file "{path}" for debugging purpose. Please remove manually!')
-                        else:
-                            os.remove(path)
+        self.log.info(f'Testing Helm deployment "{colors.blue(deployment)}" ...')
 
-            except CalledProcessError as e:
-                raise TestError(f'Error in Helm deployment "{colors.blue(deployment)}": {e.stderr}')
+        try:
+            values_path = Path(self.build_dir) \
+                .joinpath(deployment.namespace) \
+                .joinpath(self.name) \
+                .joinpath(deployment.release) \
+                .joinpath(f'values.yml')
+
+            result = HelmOutput(
+                helm_install(self.log, deployment, self.get_chart_dir(), str(values_path), dry_run=True,
+                             skip_schema_validation=self.skip_schema_validation).stdout)
+
+            is_update = result.first_deployed != result.last_deployed
+            last_update = f', last deployed {colors.bold(result.last_deployed)}' if is_update else ''
+            is_success = result.status == 'pending-upgrade' or result.status == 'pending-install'
+
+            self.log.info(f'... '
+                          f'Chart version {colors.bold(result.chart_version)}, '
+                          f'app version {colors.bold(result.app_version)}{last_update}: '
+                          f'{colors.green_bold(result.description)}, '
+                          f'status {colors.green_bold(result.status) if is_success else colors.red_bold(result.status)}')
+
+            if self.skip_raw_test:
+                self.log.info(f'Skip testing of raw manifests.')
+                return
+
+            manifest_path = Path(self.build_dir) \
+                .joinpath(deployment.namespace) \
+                .joinpath(self.name) \
+                .joinpath(deployment.release) \
+                .joinpath(f'manifest.yml')
+
+            # Test to apply via kubectl and server-dry-run
+            self.log.info(f'... Testing raw manifests from "{colors.bold(manifest_path)}" (may fail) ...')
+            self.test_raw_manifests(deployment, manifest_path)
+
+        except CalledProcessError as e:
+            raise TestError(f'Error in Helm deployment "{colors.blue(deployment)}": {e.stderr}')
@@ -1,21 +1,239 @@
 import argparse
-import sys
+import threading
+from logging import Logger
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import Dict, List, Set
 
+from jinja2 import TemplateError
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from yaml import YAMLError
+
+from adeploy.common import colors
+from adeploy.common.deployment import Deployment
+from adeploy.common.errors import DeployError, Error, RenderError, TestError
 from .common import HelmProvider
+from .renderer import Renderer
 
 
 class Watcher(HelmProvider):
+    auto_test: bool = False
+    auto_deploy: bool = False
+    debounce: float = 0.5
+    render_args: dict = None
+    renderer = None
+    tester = None
+    deployer = None
+    deployments: Dict[Path, Deployment] = None
+    changed_paths: Set[Path] = None
 
     @staticmethod
     def get_parser():
-        parser = argparse.ArgumentParser(description='Helm v3 renderer for k8s manifests',
-                                         usage=argparse.SUPPRESS)
+        # Accept the same args as the renderer
+        parser = Renderer.get_parser()
+        parser.description = 'Watch for changes in a Helm project. Renders, tests and deploys'
+
+        parser.add_argument("--test", dest='auto_test', action='store_true', default=False,
+                            help='Automatically test on changes using a dry-run.')
+        parser.add_argument("--deploy", dest='auto_deploy', action='store_true', default=False,
+                            help='Automatically deploy on changes. (requires --test)')
+        parser.add_argument("--debounce", dest='debounce', type=float, default=0.5,
+                            help='Seconds to wait for further changes before rendering. Default is 0.5.')
         return parser
 
     def parse_args(self, args: dict):
-        pass
+        self.auto_test = args.get('auto_test')
+        self.auto_deploy = args.get('auto_deploy')
+        self.debounce = args.get('debounce')
+        self.render_args = {k: v for k, v in args.items() if k not in ['auto_test', 'auto_deploy', 'debounce']}
+
+    def __init__(self, name: str, src_dir: str or Path, build_dir: str or Path, namespaces_dir: str or Path,
+                 args: argparse.Namespace, log: Logger, provider, **kwargs):
+        super().__init__(name, src_dir, build_dir, namespaces_dir, args, log, **kwargs)
+        self.renderer = provider.renderer(
+            name=name,
+            src_dir=src_dir,
+            build_dir=build_dir,
+            namespaces_dir=self.args.namespaces_dir,
+            defaults_path=self.args.defaults_path,
+            args=self.args,
+            log=self.log,
+            **self.render_args)
+        self.tester = provider.tester(
+            name=name,
+            src_dir=src_dir,
+            build_dir=build_dir,
+            namespaces_dir=self.args.namespaces_dir,
+            defaults_path=self.args.defaults_path,
+            args=self.args,
+            log=self.log,
+            skip_raw_test=False,
+            skip_schema_validation=self.render_args.get('skip_schema_validation'))
+        self.deployer = provider.deployer(
+            name=name,
+            src_dir=src_dir,
+            build_dir=build_dir,
+            namespaces_dir=self.args.namespaces_dir,
+            defaults_path=self.args.defaults_path,
+            args=self.args,
+            log=self.log,
+            skip_schema_validation=self.render_args.get('skip_schema_validation'))
+
+        self.name = self.renderer.name
+        self.deployments = {}
+        self.changed_paths = set()
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+
+    def get_watched_paths(self) -> Dict[Path, bool]:
+        paths = {}
+
+        for path in [self.renderer.chart_dir, self.renderer.hooks_dir, self.namespaces_dir]:
+            if path.is_dir():
+                paths[path] = True
+
+        defaults_file = self.get_defaults_file()
+        if defaults_file and defaults_file.parent not in paths:
+            paths[defaults_file.parent] = False
+
+        return paths
+
+    @staticmethod
+    def is_relative(path: Path, base: Path) -> bool:
+        try:
+            path.relative_to(base)
+            return True
+        except ValueError:
+            return False
+
+    def is_deployment_config(self, path: Path) -> bool:
+        if path.suffix[1:] not in self.extensions or not self.is_relative(path, self.namespaces_dir):
+            return False
+
+        # Structure 2 takes precedence over structure 1, see load_deployments()
+        parts = path.relative_to(self.namespaces_dir).parts
+        deployment_dir = self.namespaces_dir.joinpath(parts[0]).joinpath(self.name)
+        if not deployment_dir.is_dir():
+            deployment_dir = self.namespaces_dir.joinpath(parts[0])
+
+        return path.parent == deployment_dir
+
+    def handle_event(self, event: FileSystemEvent):
+        # Ignore i.e. opened and closed events caused by reading files while rendering
+        if event.event_type not in ['created', 'deleted', 'modified', 'moved']:
+            return
+
+        if event.is_directory and event.event_type == 'modified':
+            return
+
+        paths = [event.src_path] + ([event.dest_path] if getattr(event, 'dest_path', None) else [])
+        paths = [Path(p) for p in paths if not p.endswith('~')]
+
+        with self.lock:
+            self.changed_paths.update(paths)
+        self.changed.set()
+
+    def process(self, deployments: List[Deployment]):
+        rendered = self.renderer.render_deployments(deployments)
+        if self.auto_test:
+            for deployment in rendered:
+                self.tester.test_deployment(deployment)
+                if self.auto_deploy:
+                    self.deployer.deploy_deployment(deployment)
+
+    def reload_deployments(self) -> List[Deployment]:
+        self.deployments = {d.config_path: d for d in self.renderer.load_deployments()}
+        return list(self.deployments.values())
+
+    def handle_changes(self, paths: Set[Path]):
+
+        chart_changed = any(self.is_relative(p, self.renderer.chart_dir) for p in paths)
+        hooks_changed = any(self.is_relative(p, self.renderer.hooks_dir) for p in paths)
+        defaults_changed = self.get_defaults_file() in paths
+        configs = sorted([p for p in paths if self.is_deployment_config(p)])
+
+        if defaults_changed:
+            self.log.info(f'Defaults changed, reloading all deployments ...')
+            chart = (self.renderer.name, self.renderer.repo_url, self.renderer.get_chart_version())
+            self.renderer.parse_args(self.render_args)
+            if chart != (self.renderer.name, self.renderer.repo_url, self.renderer.get_chart_version()):
+                self.renderer.resolved_chart_version = None
+                self.name = self.tester.name = self.deployer.name = self.renderer.name
+                chart_changed = True
+
+        if chart_changed or hooks_changed:
+            self.log.info(f'Chart or hooks changed, rebuilding chart "{colors.bold(self.renderer.name)}" ...')
+            self.renderer.prepare_chart()
+
+        # All deployments are affected by changes of the chart or defaults
+        if chart_changed or hooks_changed or defaults_changed:
+            self.process(self.reload_deployments())
+            return
+
+        deployments = []
+        for path in configs:
+            if path.is_file():
+                deployment = self.renderer.load_deployment(path.relative_to(self.namespaces_dir).parts[0], path)
+                if deployment:
+                    self.log.info(f'Config changed for deployment "{colors.blue(deployment)}" ...')
+                    self.deployments[path] = deployment
+                    deployments.append(deployment)
+
+            elif path in self.deployments:
+                deployment = self.deployments.pop(path)
+                self.log.warning(f'Config removed for deployment "{colors.blue(deployment)}". Note that the release '
+                                 f'is not removed from the cluster.')
+
+        self.process(deployments)
 
     def run(self):
 
-        self.log.error(f'Watch mode is not supported by the helm provider...')
-        sys.exit(1)
+        self.log.debug(f'Working on deployment "{self.name}" ...')
+
+        self.renderer.prepare_chart()
+        self.process(self.reload_deployments())
+
+        observer = Observer()
+        event_handler = FileSystemEventHandler()
+        event_handler.on_any_event = self.handle_event
+        for path, recursive in self.get_watched_paths().items():
+            self.log.debug(f'Watching for changes in "{path}" ...')
+            observer.schedule(event_handler, str(path), recursive=recursive)
+        observer.start()
+
+        self.log.info(f'Startup finished. Watching for changes ...')
+        try:
+            while True:
+                self.changed.wait()
+
+                # Debounce, wait until no more changes arrive
+                while True:
+                    self.changed.clear()
+                    if not self.changed.wait(self.debounce):
+                        break
+
+                with self.lock:
+                    paths = self.changed_paths
+                    self.changed_paths = set()
+
+                try:
+                    self.handle_changes(paths)
+                except (RenderError, CalledProcessError) as e:
+                    self.log.error(colors.red(f'Error rendering chart "{self.name}":'))
+                    self.log.error(colors.red_bold(str(e)))
+                except TestError as e:
+                    self.log.error(colors.red(f'Error testing chart "{self.name}":'))
+                    self.log.error(colors.red_bold(str(e)))
+                except DeployError as e:
+                    self.log.error(colors.red(f'Error deploying chart "{self.name}":'))
+                    self.log.error(colors.red_bold(str(e)))
+                except (Error, TemplateError, YAMLError, OSError) as e:
+                    # I.e. invalid configs or files that are being edited, keep watching for the next change
+                    self.log.error(colors.red(f'Error updating chart "{self.name}":'))
+                    self.log.error(colors.red_bold(str(e)))
+
+        except KeyboardInterrupt:
+            observer.stop()
+            observer.join()
+            return True
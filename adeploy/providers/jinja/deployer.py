@@ -14,6 +14,7 @@ from adeploy.common.provider import Provider
 
 
 class Deployer(Provider):
+    config_cache = True
 
     @staticmethod
     def manifest_is_configmap(manifest_path) -> bool:
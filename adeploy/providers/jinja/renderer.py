@@ -4,6 +4,7 @@ import json
 import os
 from logging import Logger
 from pathlib import Path
+from typing import List, Set
 
 import jinja2
 from ruamel.yaml import YAML
@@ -83,11 +84,23 @@ class Renderer(Provider):
     def get_template_output_path(deployment, template):
         return deployment.manifests_dir.joinpath(template)
 
-    def render_template(self, deployment: Deployment, template_path: str, prefix: str = '...'):
+    @staticmethod
+    def get_template_output_paths(deployment, template) -> List[Path]:
+        # Templates with multiple documents are rendered to one file per document, see render_template()
+        output_path = Renderer.get_template_output_path(deployment, template)
+        paths = [output_path] + sorted(output_path.parent.glob(f'{output_path.stem}.[0-9]*.yml'))
+        return [p for p in paths if p.is_file()]
+
+    def render_template(self, deployment: Deployment, template_path: str, prefix: str = '...') -> Set[str]:
+        """
+        Render the template for the deployment. Returns the paths of the files used for rendering i.e. the template,
+        imported macros, includes and files read by global functions.
+        """
         jinja_env.register_globals(self.env, deployment, self.log, self.templates_dir)
         values = deployment.get_template_values()
         try:
-            rendered_template = self.env.get_template(template_path).render(**values)
+            with self.env.record_dependencies() as dependencies:
+                rendered_template = self.env.get_template(template_path).render(**values)
         except jinja2.exceptions.TemplateNotFound as e:
             self.log.debug(f'Used Jinja variables: {json.dumps(values)}')
             raise RenderError(f'Jinja template error: Template "{e}" not found in "{template_path}"')
@@ -126,6 +139,8 @@ class Renderer(Provider):
         except MarkedYAMLError as e:
             raise RenderError(f'YAML error in "{colors.bold(template_path)}": {e}')
 
+        return dependencies
+
     def run(self):
         self.log.debug(f'Working on deployment "{self.name}" ...')
         template_dir, templates = self.load_templates()
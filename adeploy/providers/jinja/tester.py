@@ -15,6 +15,8 @@ from adeploy.common.provider import Provider
 
 
 class Tester(Provider):
+    config_cache = True
+
     @staticmethod
     def get_parser():
         parser = argparse.ArgumentParser(description='Jinja tester for k8s manifests written in Jinja',
@@ -1,15 +1,20 @@
 import argparse
 import os
 import shutil
-import time
+import threading
+from functools import partial
 from logging import Logger
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
 from watchdog.observers import Observer
-from watchdog.events import FileModifiedEvent, FileSystemEventHandler
+from watchdog.events import FileSystemEventHandler
 
 from adeploy.common import colors
-from adeploy.common.errors import DeployError, RenderError, TestError
+from adeploy.common.deployment import Deployment
+from adeploy.common.errors import DeployError, Error, RenderError, TestError
 from adeploy.common.provider import Provider
+from adeploy.common.work_queue import WorkQueue
 
 
 class Watcher(Provider):
@@ -18,8 +23,19 @@ class Watcher(Provider):
     auto_test: bool = False
     auto_deploy: bool = False
     deploy_on_start: bool = False
-    watchers: list = []
-    restart_rendering = False
+    debounce: float = 0.3
+    queue: WorkQueue = None
+    test_queue: WorkQueue = None
+    deploy_queue: WorkQueue = None
+    stage_queue_size: int = 100
+    observer: Observer = None
+    event_handler: FileSystemEventHandler = None
+    roots: Dict[str, bool] = None
+    templates: List[str] = None
+    index: Dict[str, Set[Tuple[Deployment, str]]] = None
+    configs: Dict[str, Set[Deployment]] = None
+    dependencies: Dict[Tuple[Deployment, str], Set[str]] = None
+    deployments: Dict[str, Deployment] = None
     renderer = None
     tester = None
     deployer = None
@@ -41,6 +57,8 @@ class Watcher(Provider):
                             help='Automatically deploy on changes. (requires --test)')
         parser.add_argument("--deploy-on-start", dest='deploy_on_start', action='store_true', default=False,
                             help='Deploy on start.')
+        parser.add_argument("--debounce", dest='debounce', type=float, default=0.3,
+                            help='Seconds to wait for further changes of a template before rendering. Default is 0.3.')
         return parser
 
     def parse_args(self, args):
@@ -49,6 +67,7 @@ class Watcher(Provider):
         self.auto_test = args.get('auto_test')
         self.auto_deploy = args.get('auto_deploy')
         self.deploy_on_start = args.get('deploy_on_start')
+        self.debounce = args.get('debounce')
 
     def __init__(self, name: str, src_dir: str or Path, build_dir: str or Path, namespaces_dir: str or Path,
                  args: argparse.Namespace, log: Logger, provider, **kwargs):
@@ -79,96 +98,354 @@ class Watcher(Provider):
             args=self.args,
             log=self.log)
 
+        # Renderings and changes of templates and deployments are done by a dedicated worker, so bursts of events do
+        # not block the observer and the watched state is only changed by a single thread
+        self.queue = WorkQueue(lambda key, job: job(), self.log, debounce=self.debounce, name='watch-worker')
+
+        # Protects the index and the watched templates and deployments, which are read by the stage workers
+        self.lock = threading.Lock()
+
+        # Rendered manifests are tested and deployed by separate stages, so rendering stays responsive while waiting
+        # for the cluster. The stage queues are bounded to slow down rendering if the cluster cannot keep up.
+        self.test_queue = WorkQueue(lambda key, job: job(), self.log, debounce=0, name='watch-test',
+                                    maxsize=self.stage_queue_size)
+        self.deploy_queue = WorkQueue(lambda key, job: job(), self.log, debounce=0, name='watch-deploy',
+                                      maxsize=self.stage_queue_size)
+
+        # The tester temporarily changes the default namespace of the kube config, so tests and deployments must not
+        # run at the same time
+        self.cluster_lock = threading.Lock()
+
     def run(self):
         self.log.debug(f'Working on deployment "{self.name}" ...')
-        template_dir, templates = self.renderer.load_templates()
+        self.index = {}
+        self.configs = {}
+        self.dependencies = {}
+        self.deployments = {}
+        self.roots = {}
+        self.add_root(path=self.renderer.templates_dir, recursive=True)
+        self.add_root(path=str(self.namespaces_dir), recursive=True)
+        self.add_root(path=os.path.dirname(str(self.get_defaults_file() or self.defaults_path)), recursive=False)
+        template_dir, self.templates = self.renderer.load_templates()
         for deployment in self.renderer.load_deployments():
+            self.deployments[os.path.realpath(deployment.config_path)] = deployment
+            self.index_deployment(deployment)
             self.log.debug(f'Clean build dirs: {[colors.bold(d) for d in deployment.clean_build_dir()]}')
             if not self.deploy_on_start:
                 self.log.info(f'Rendering deployment "{colors.blue(deployment)}" ...')
             else:
                 self.log.info(f'Deploying deployment "{colors.blue(deployment)}" ...')
-            self.create_restart_watcher(
-                path=os.path.join(self.namespaces_dir, deployment.namespace, f'{deployment.release}.yml'),
-                recursive=False
-            )
-            for template in templates:
-                self.renderer.render_template(deployment, template, prefix='Initial rendering:')
+            for template in self.templates:
+                self.index_template(deployment, template,
+                                    self.renderer.render_template(deployment, template, prefix='Initial rendering:'))
                 if self.deploy_on_start and os.path.exists(
                         self.renderer.get_template_output_path(deployment, template)):
                     self.tester.test_maifest(self.renderer.get_template_output_path(deployment, template),
                                              prefix="Initial testing:")
                     self.deployer.deploy_manifest(self.renderer.get_template_output_path(deployment, template),
                                                   prefix="Initial deployment:")
-                self.create_template_watcher(deployment, template, self.renderer.jinja_pathes)
 
         # Watch for changes
-        self.create_restart_watcher(path=os.path.join(self.src_dir, self.templates_dir), recursive=True)
-        self.create_restart_watcher(path=str(self.defaults_path), recursive=False)
+        self.start_observer()
+        for queue in [self.queue, self.test_queue, self.deploy_queue]:
+            queue.start()
         self.log.info(f'Startup finished. Watching for changes ...')
         try:
-            while True:
-                time.sleep(1)
-                if self.restart_rendering:
-                    self.log.debug(f'Stopping all file watchers...')
-                    for observer in self.watchers:
-                        observer.stop()
-                        observer.join()
-                    self.watchers = []
-                    self.restart_rendering = False
-                    self.run()
+            self.observer.join()
         except KeyboardInterrupt:
+            self.observer.stop()
+            self.observer.join()
+            for queue in [self.queue, self.test_queue, self.deploy_queue]:
+                queue.stop()
             return True
 
-    def get_restarting_event_handler(self) -> FileSystemEventHandler:
-        event_handler = FileSystemEventHandler()
-        event_handler.on_created = lambda event: self.handle_create_and_delete_event(event)
-        event_handler.on_deleted = lambda event: self.handle_create_and_delete_event(event)
-        return event_handler
-
-    def create_restart_watcher(self, path: str, recursive: bool):
-        self.log.debug(f'Watching for changes in "{path}" ...')
-        observer = Observer()
-        observer.schedule(self.get_restarting_event_handler(), path, recursive)
-        self.watchers.append(observer)
-        observer.start()
-
-    def create_template_watcher(self, deployment, template, paths):
-        for path in paths:
-            if os.path.exists(os.path.join(path, template)):
-                template_path = os.path.join(path, template)
-                self.log.debug(f'Watching for changes in template "{template_path}" ...')
-                observer = Observer()
-                event_handler = FileSystemEventHandler()
-                event_handler.on_modified = lambda event: self.handle_modified_event(deployment, template, event)
-                observer.schedule(event_handler, template_path, recursive=False)
-                self.watchers.append(observer)
-                observer.start()
+    def add_root(self, path: str, recursive: bool):
+        path = os.path.realpath(path)
+        if not os.path.isdir(path):
+            return
+
+        # A recursive root covers all of its sub dirs
+        for root, root_recursive in self.roots.items():
+            if path == root and (root_recursive or not recursive):
+                return
+            if root_recursive and path.startswith(root + os.sep):
                 return
-        raise RenderError(f'Could not create watcher for template "{template}"')
 
-    def handle_create_and_delete_event(self, event):
+        self.roots[path] = recursive
+
+        # Roots added for new dependencies while watching
+        if self.observer:
+            self.log.debug(f'Watching for changes in "{path}" ...')
+            self.observer.schedule(self.event_handler, path, recursive=recursive)
+
+    def start_observer(self):
+        self.event_handler = FileSystemEventHandler()
+        self.event_handler.on_created = lambda event: self.queue_path(event.src_path)
+        self.event_handler.on_deleted = lambda event: self.queue_path(event.src_path)
+        self.event_handler.on_moved = lambda event: self.handle_moved_event(event)
+        self.event_handler.on_modified = lambda event: self.dispatch_modified_event(event)
+
+        # Use a single observer for all roots, events are dispatched using the path index
+        self.observer = Observer()
+        for path, recursive in self.roots.items():
+            self.log.debug(f'Watching for changes in "{path}" ...')
+            self.observer.schedule(self.event_handler, path, recursive=recursive)
+        self.observer.start()
+
+    def watch_dependency(self, path: str):
+        self.add_root(path if os.path.isdir(path) else os.path.dirname(path), recursive=False)
+
+    @staticmethod
+    def is_below(path: str, base: str) -> bool:
+        return path == base or path.startswith(base + os.sep)
+
+    def get_template_name(self, path: str) -> Optional[str]:
+        # Same rules as in Renderer.load_templates()
+        templates_dir = os.path.realpath(self.renderer.templates_dir)
+        if not path.startswith(templates_dir + os.sep) or os.path.basename(path)[0] in ['.', '_'] or \
+                os.path.splitext(path)[1] not in ['.yaml', '.yml']:
+            return None
+        return os.path.relpath(path, templates_dir)
+
+    def is_deployment_config(self, path: str) -> bool:
+        namespaces_dir = os.path.realpath(self.namespaces_dir)
+        if os.path.splitext(path)[1][1:] not in self.extensions or not path.startswith(namespaces_dir + os.sep):
+            return False
+
+        # Structure 2 takes precedence over structure 1, see load_deployments()
+        ns = os.path.relpath(path, namespaces_dir).split(os.sep)[0]
+        deployment_dir = os.path.join(namespaces_dir, ns, self.name)
+        if not os.path.isdir(deployment_dir):
+            deployment_dir = os.path.join(namespaces_dir, ns)
+
+        return os.path.dirname(path) == deployment_dir
+
+    def index_deployment(self, deployment: Deployment):
+        # The deployment config depends on the config file, the defaults and files read by global functions
+        with self.lock:
+            for path in set([os.path.realpath(deployment.config_path)]) | deployment.dependencies:
+                self.configs.setdefault(path, set()).add(deployment)
+                self.watch_dependency(path)
+
+    def unindex_deployment(self, deployment: Deployment):
+        with self.lock:
+            for deployments in self.configs.values():
+                deployments.discard(deployment)
+
+    def index_template(self, deployment: Deployment, template: str, dependencies: Set[str]):
+        job = (deployment, template)
+        self.unindex_template(deployment, template)
+        with self.lock:
+            for path in dependencies:
+                self.log.debug(f'Watching for changes in "{path}" used by template "{template}" ...')
+                self.index.setdefault(path, set()).add(job)
+                self.watch_dependency(path)
+            self.dependencies[job] = dependencies
+
+    def unindex_template(self, deployment: Deployment, template: str):
+        job = (deployment, template)
+        with self.lock:
+            for path in self.dependencies.pop(job, set()):
+                self.index.get(path, set()).discard(job)
+
+    def queue_path(self, path: str):
+        if path.endswith('~'):
+            return
+        path = os.path.realpath(path)
+        self.queue.put(('path', path), partial(self.update_path, path))
+
+    def handle_moved_event(self, event):
+        self.queue_path(event.src_path)
+        self.queue_path(event.dest_path)
+
+    def queue_template(self, deployment: Deployment, template: str):
+        # Coalesce repeated events for the same job i.e. caused by editors writing a file in several steps
+        self.queue.put((str(deployment), template), partial(self.render_template, deployment, template))
+
+    def queue_deployment(self, deployment: Deployment):
+        self.queue.put((str(deployment), None), partial(self.reload_deployment, deployment))
+
+    def dispatch_modified_event(self, event):
         if event.src_path.endswith('~'):
             return
-        self.restart_rendering = True
-
-    def handle_modified_event(self, deployment, template, event):
-        if isinstance(event, FileModifiedEvent):
-            self.log.debug(f'{template} modified. Rendering...')
-            try:
-                self.renderer.render_template(deployment, template, prefix="Autorender:")
-                if self.auto_test:
-                    self.tester.test_maifest(self.renderer.get_template_output_path(deployment, template),
-                                             prefix="Autotest:")
-                    if self.auto_deploy:
-                        self.deployer.deploy_manifest(self.renderer.get_template_output_path(deployment, template),
-                                                      prefix="Autodeploy:")
-            except RenderError as e:
-                self.log.error(colors.red(f'Error rendering template "{template}":'))
-                self.log.error(colors.red_bold(str(e)))
-            except TestError as e:
-                self.log.error(colors.red(f'Error testing rendered manifest for "{template}":'))
-                self.log.error(colors.red_bold(str(e)))
-            except DeployError as e:
-                self.log.error(colors.red(f'Error deploying rendered manifest for "{template}":'))
-                self.log.error(colors.red_bold(str(e)))
+        self.dispatch_path(os.path.realpath(event.src_path))
+
+    def dispatch_path(self, path: str):
+        with self.lock:
+            deployments = sorted(self.configs.get(path, []), key=str)
+            jobs = sorted(self.index.get(path, []), key=lambda j: (str(j[0]), j[1]))
+
+        # Changed configs affect all templates of the deployment
+        for deployment in deployments:
+            self.queue_deployment(deployment)
+
+        for deployment, template in jobs:
+            self.queue_template(deployment, template)
+
+    def update_path(self, path: str):
+        """
+        Update the watched templates and deployments for a created, deleted or moved file or dir.
+        """
+
+        def scan(predicate) -> Set[str]:
+            if os.path.isfile(path):
+                return set([path]) if predicate(path) else set()
+            return set([os.path.join(root, f) for root, _, files in os.walk(path) for f in files
+                        if predicate(os.path.join(root, f))])
+
+        # Created or deleted files may change the resolved paths of templates and includes
+        self.renderer.env.loader.clear_cache()
+
+        templates_dir = os.path.realpath(self.renderer.templates_dir)
+        updated = False
+        for template in [t for t in self.templates if self.is_below(os.path.join(templates_dir, t), path)]:
+            if not os.path.isfile(os.path.join(templates_dir, template)):
+                self.remove_template(template)
+                updated = True
+
+        for template in sorted([self.get_template_name(p) for p in scan(self.get_template_name)]):
+            if template not in self.templates:
+                self.add_template(template)
+                updated = True
+
+        for config_path in [p for p in self.deployments.keys() if self.is_below(p, path)]:
+            if not os.path.isfile(config_path):
+                self.remove_deployment(config_path)
+                updated = True
+
+        for config_path in sorted(scan(self.is_deployment_config)):
+            if config_path not in self.deployments:
+                self.add_deployment(config_path)
+                updated = True
+
+        # All deployments depend on a created defaults file
+        defaults_file = self.get_defaults_file()
+        if defaults_file and path == os.path.realpath(defaults_file):
+            for deployment in self.deployments.values():
+                self.queue_deployment(deployment)
+
+        # Files may also be used by templates or deployments i.e. if replaced by editors
+        if not updated:
+            self.dispatch_path(path)
+
+    def add_template(self, template: str):
+        self.log.info(f'Template "{colors.bold(template)}" added. Rendering ...')
+        with self.lock:
+            self.templates = sorted(self.templates + [template])
+        for deployment in self.deployments.values():
+            self.queue_template(deployment, template)
+
+    def remove_template(self, template: str):
+        self.log.info(f'Template "{colors.bold(template)}" removed. Removing rendered manifests ...')
+        with self.lock:
+            self.templates = [t for t in self.templates if t != template]
+        for deployment in self.deployments.values():
+            self.unindex_template(deployment, template)
+            for output_path in self.renderer.get_template_output_paths(deployment, template):
+                self.log.debug(f'... remove "{colors.bold(output_path)}"')
+                output_path.unlink(missing_ok=True)
+
+    def add_deployment(self, config_path: str):
+        ns = os.path.relpath(config_path, os.path.realpath(self.namespaces_dir)).split(os.sep)[0]
+        try:
+            deployment = self.renderer.load_deployment(ns, Path(config_path))
+        except Error as e:
+            self.log.error(colors.red(f'Error loading deployment config "{config_path}":'))
+            self.log.error(colors.red_bold(str(e)))
+            return
+
+        if not deployment:
+            return
+
+        self.log.info(f'Deployment "{colors.blue(deployment)}" added. Rendering ...')
+        with self.lock:
+            self.deployments[config_path] = deployment
+        self.index_deployment(deployment)
+        for template in self.templates:
+            self.queue_template(deployment, template)
+
+    def remove_deployment(self, config_path: str):
+        with self.lock:
+            deployment = self.deployments.pop(config_path)
+        self.log.warning(f'Deployment "{colors.blue(deployment)}" removed. Removing rendered manifests, note that '
+                         f'the deployment is not removed from the cluster ...')
+        self.unindex_deployment(deployment)
+        for template in self.templates:
+            self.unindex_template(deployment, template)
+        shutil.rmtree(deployment.manifests_dir, ignore_errors=True)
+
+    def is_active(self, deployment: Deployment, template: str = None) -> bool:
+        # Jobs may be queued for templates or deployments that have been removed in the meantime
+        with self.lock:
+            return deployment in self.deployments.values() and (template is None or template in self.templates)
+
+    def reload_deployment(self, deployment: Deployment):
+        if not self.is_active(deployment):
+            return
+
+        try:
+            self.log.info(f'Config of deployment "{colors.blue(deployment)}" changed. Reloading ...')
+            deployment.load_config(deployment.config_path, self.get_defaults_file(), self.log)
+            self.unindex_deployment(deployment)
+            self.index_deployment(deployment)
+        except Error as e:
+            self.log.error(colors.red(f'Error loading config of deployment "{deployment}":'))
+            self.log.error(colors.red_bold(str(e)))
+            return
+
+        for template in self.templates:
+            self.render_template(deployment, template)
+
+    def is_stale(self, key, stages: List[WorkQueue]) -> bool:
+        # Results are outdated if the template has been changed again, i.e. a job is pending in a previous stage
+        return any(stage.is_pending(key) for stage in stages)
+
+    def render_template(self, deployment: Deployment, template: str):
+        if not self.is_active(deployment, template):
+            return
+
+        key = (str(deployment), template)
+        self.log.debug(f'{template} modified. Rendering...')
+        try:
+            self.index_template(deployment, template,
+                                self.renderer.render_template(deployment, template, prefix="Autorender:"))
+        except RenderError as e:
+            self.log.error(colors.red(f'Error rendering template "{template}":'))
+            self.log.error(colors.red_bold(str(e)))
+            return
+
+        if self.auto_test and not self.is_stale(key, [self.queue]):
+            self.test_queue.put(key, partial(self.test_template, deployment, template))
+
+    def test_template(self, deployment: Deployment, template: str):
+        key = (str(deployment), template)
+        if not self.is_active(deployment, template) or self.is_stale(key, [self.queue, self.test_queue]):
+            self.log.debug(f'{template} changed in the meantime, skip testing outdated manifest')
+            return
+
+        try:
+            with self.cluster_lock:
+                self.tester.test_maifest(self.renderer.get_template_output_path(deployment, template),
+                                         prefix="Autotest:")
+        except TestError as e:
+            self.log.error(colors.red(f'Error testing rendered manifest for "{template}":'))
+            self.log.error(colors.red_bold(str(e)))
+            return
+
+        if self.auto_deploy:
+            self.deploy_queue.put(key, partial(self.deploy_template, deployment, template))
+
+    def deploy_template(self, deployment: Deployment, template: str):
+        key = (str(deployment), template)
+        if not self.is_active(deployment, template) or \
+                self.is_stale(key, [self.queue, self.test_queue, self.deploy_queue]):
+            self.log.debug(f'{template} changed in the meantime, skip deploying outdated manifest')
+            return
+
+        try:
+            with self.cluster_lock:
+                self.deployer.deploy_manifest(self.renderer.get_template_output_path(deployment, template),
+                                              prefix="Autodeploy:")
+        except DeployError as e:
+            self.log.error(colors.red(f'Error deploying rendered manifest for "{template}":'))
+            self.log.error(colors.red_bold(str(e)))
@@ -3,3 +3,4 @@ from .render import Render
 from .test import Test
 from .deploy import Deploy
 from .config import Config
+from .pipeline import Pipeline
@@ -14,72 +14,69 @@ class Deploy:
         self.log = log
 
         if 'deploy' in self.args:
+            self.run(provider, vars(provider.deployer.get_parser().parse_args(deploy_args)))
+            sys.exit(0)
 
-            num_warnings = 0
-
-            for src_dir in self.args.src_dirs:
+    def run(self, provider, deploy_args: dict):
+        num_warnings = 0
 
-                src_dir = os.path.realpath(src_dir)
-                name = self.args.deployment_name or os.path.basename(src_dir)
-                build_dir = Path(self.args.build_dir).joinpath(self.args.provider)
+        for src_dir in self.args.src_dirs:
 
-                if not os.path.isdir(src_dir):
-                    self.log.warning(colors.orange(f'"{src_dir}" is not a directory, skip'))
-                    num_warnings += 1
-                    continue
+            src_dir = os.path.realpath(src_dir)
+            name = self.args.deployment_name or os.path.basename(src_dir)
+            build_dir = Path(self.args.build_dir).joinpath(self.args.provider)
 
-                try:
-                    deployer = provider.deployer(
-                        name=name,
-                        src_dir=src_dir,
-                        build_dir=build_dir,
-                        namespaces_dir=self.args.namespaces_dir,
-                        defaults_path=self.args.defaults_path,
-                        args=self.args,
-                        log=self.log,
-                        **vars(provider.deployer.get_parser().parse_args(deploy_args)))
+            if not os.path.isdir(src_dir):
+                self.log.warning(colors.orange(f'"{src_dir}" is not a directory, skip'))
+                num_warnings += 1
+                continue
 
-                    self.log.info(
-                        colors.green_bold('Deploying ') + colors.bold(src_dir) + ' in ' +
-                        colors.bold(self.args.build_dir) + ' using the provider ' +
-                        colors.bold(self.args.provider)
-                    )
+            try:
+                deployer = provider.deployer(
+                    name=name,
+                    src_dir=src_dir,
+                    build_dir=build_dir,
+                    namespaces_dir=self.args.namespaces_dir,
+                    defaults_path=self.args.defaults_path,
+                    args=self.args,
+                    log=self.log,
+                    **deploy_args)
 
-                    # Create secrets
-                    secrets = [] # Respect user filters
-                    for secret in Secret.get_stored(build_dir, name):
+                self.log.info(
+                    colors.green_bold('Deploying ') + colors.bold(src_dir) + ' in ' +
+                    colors.bold(self.args.build_dir) + ' using the provider ' +
+                    colors.bold(self.args.provider)
+                )
 
-                        deployment = secret.deployment
+                # Create secrets
+                secrets = []
+                for secret in Secret.get_stored(build_dir, name, self.args, self.log):  # Respect user filters
 
-                        if deployment.skipped(self.args):
-                            self.log.info(f'... Secret "{colors.blue(secret.name)}" for '
-                                          f'deployment "{colors.blue(deployment)}" skipped by user filter.')
-                            continue
+                    deployment = secret.deployment
 
-                        # Skip cluster
-                        if not deployer.verify_current_cluster_is_last_cluster(deployment):
-                            continue
+                    # Skip cluster
+                    if not deployer.verify_current_cluster_is_last_cluster(deployment):
+                        continue
 
-                        secrets.append(secret)
-                        secret.deploy(self.log, self.args.recreate_secrets)
+                    secrets.append(secret)
 
-                    # Remove unused secrets
-                    Secret.clean_all(secrets, self.log, dry_run=False)
+                Secret.deploy_all(secrets, self.log, self.args.recreate_secrets, self.args.sync_secrets)
 
-                    # Do the deployments
-                    deployer.run()
+                # Remove unused secrets
+                Secret.clean_all(secrets, self.log, dry_run=False)
 
-                except DeployError as e:
-                    self.log.error(colors.red(f'Deployment failed in source directory "{src_dir}":'))
-                    self.log.error(colors.red_bold(str(e)))
-                    sys.exit(1)
+                # Do the deployments
+                deployer.run()
 
-            if num_warnings > 0:
-                self.log.warning(colors.orange(f'Deployment finished with {num_warnings} warnings'))
-            else:
-                self.log.info(colors.green_bold(f'Deployment finished'))
+            except DeployError as e:
+                self.log.error(colors.red(f'Deployment failed in source directory "{src_dir}":'))
+                self.log.error(colors.red_bold(str(e)))
+                sys.exit(1)
 
-            sys.exit(0)
+        if num_warnings > 0:
+            self.log.warning(colors.orange(f'Deployment finished with {num_warnings} warnings'))
+        else:
+            self.log.info(colors.green_bold(f'Deployment finished'))
 
 
 if __name__ == '__main__':
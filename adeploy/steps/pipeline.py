@@ -0,0 +1,110 @@
+import json
+import logging
+import sys
+import time
+
+from adeploy.common import colors
+from adeploy.common.errors import InputError
+from adeploy.common.provider import Provider
+from adeploy.steps.deploy import Deploy
+from adeploy.steps.render import Render
+from adeploy.steps.test import Test
+
+
+class Pipeline:
+
+    # Build steps that can be chained and the provider class used to parse their arguments
+    stages = {
+        'render': (Render, 'renderer'),
+        'test': (Test, 'tester'),
+        'deploy': (Deploy, 'deployer'),
+    }
+
+    def __init__(self, provider, args, pipeline_args, log):
+        self.args = args
+        self.log = log
+
+        if 'pipeline' in self.args:
+            stages = self.parse_stages(self.args.pipeline_stages)
+            stage_args = self.parse_stage_args(provider, stages, pipeline_args)
+
+            # Steps share the providers' caches, the deployments and the secrets registered while rendering
+            Provider.share_deployments()
+
+            timings = []
+            for stage in stages:
+                step, _ = self.stages[stage]
+                start = time.monotonic()
+                step(provider, args, pipeline_args, logging.getLogger(f'adeploy.{step.__name__}')) \
+                    .run(provider, stage_args[stage])
+                duration = f'{time.monotonic() - start:.2f}s'
+                timings.append(f'{stage} {colors.bold(duration)}')
+                self.log.info(colors.green_bold(f'Stage "{stage}" finished') + f' in {colors.bold(duration)}')
+
+            self.log.info(colors.green_bold(f'Pipeline finished') + f': {", ".join(timings)}')
+            sys.exit(0)
+
+    def parse_stages(self, value: str) -> list:
+        stages = [s.strip() for s in value.split(',') if s.strip()]
+        if len(stages) == 0:
+            raise InputError(f'No build steps given, expected i.e. "{colors.bold(",".join(self.stages.keys()))}"')
+
+        for stage in stages:
+            if stage not in self.stages:
+                raise InputError(f'Build step "{colors.bold(stage)}" cannot be used in a pipeline, '
+                                 f'supported are: {", ".join(self.stages.keys())}')
+
+        return stages
+
+    def parse_stage_args(self, provider, stages: list, pipeline_args: list) -> dict:
+        """
+        Split the provider arguments by the stages that know the option and let each stage parse its arguments.
+        Options must be given in full and must have the same meaning in all stages that know them.
+        """
+        parsers = {}
+        defaults = {}
+        for stage in stages:
+            _, provider_class = self.stages[stage]
+            parsers[stage] = getattr(provider, provider_class).get_parser()
+            parsers[stage].allow_abbrev = False
+            defaults[stage] = vars(parsers[stage].parse_known_args([])[0])
+
+        # Group the options with their values i.e. ["--jobs", "4"], values may also be attached i.e. "--jobs=4"
+        groups = []
+        for arg in pipeline_args:
+            if arg.startswith('-') or not groups:
+                groups.append([])
+            groups[-1].append(arg)
+
+        stage_args = {stage: [] for stage in stages}
+        for group in groups:
+
+            # Let each stage parse the option, stages that do not know it leave it unparsed
+            known = {}
+            for stage, parser in parsers.items():
+                args, unknown = parser.parse_known_args(group)
+                if group[0] not in unknown:
+                    changed = {k: v for k, v in vars(args).items() if v != defaults[stage].get(k)}
+                    known[stage] = (tuple(unknown), json.dumps(changed, sort_keys=True, default=str))
+
+            if not known:
+                raise InputError(f'Unrecognized argument "{colors.bold(" ".join(group))}" for the build steps '
+                                 f'{", ".join(stages)}')
+
+            if len(set(known.values())) > 1:
+                raise InputError(f'Argument "{colors.bold(group[0])}" is ambiguous, it is used differently by the '
+                                 f'build steps {", ".join(known.keys())}')
+
+            unknown, _ = list(known.values())[0]
+            if unknown:
+                raise InputError(f'Unrecognized argument "{colors.bold(" ".join(unknown))}" for the build steps '
+                                 f'{", ".join(stages)}')
+
+            for stage in known.keys():
+                stage_args[stage] += group
+
+        return {stage: vars(parsers[stage].parse_args(args)) for stage, args in stage_args.items()}
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from adeploy.common.errors import RenderError
+from adeploy.common.http_cache import HttpCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves the content of the server and answers conditional requests with 304 if unchanged.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        etag = f'"{hashlib.sha256(server.content).hexdigest()}"' if server.etag else None
+        if (etag and self.headers.get('If-None-Match') == etag) or \
+                (not etag and self.headers.get('If-Modified-Since') == server.last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if etag:
+            self.send_header('ETag', etag)
+        else:
+            self.send_header('Last-Modified', server.last_modified)
+        self.send_header('Content-Length', str(len(server.content)))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+        self.offline = False
+        self.patches = [
+            mock.patch.object(HttpCache, 'get_cache_dir', lambda: Path(self.cache_dir.name)),
+            mock.patch.object(HttpCache, 'is_offline', lambda: self.offline),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.content = b'key: value\n'
+        self.server.etag = True
+        self.server.last_modified = formatdate(usegmt=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/{self.id()}.yml'
+        self.log = logging.getLogger('adeploy.test')
+
+    def tearDown(self):
+        self.stop_server()
+        for patch in self.patches:
+            patch.stop()
+        self.cache_dir.cleanup()
+
+    def stop_server(self):
+        if self.thread:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.thread = None
+
+    def test_revalidate_etag(self):
+        etag = f'"{hashlib.sha256(self.server.content).hexdigest()}"'
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: value\n')
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: value\n')
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+        self.assertEqual(self.server.requests[1].get('If-None-Match'), etag)
+
+    def test_revalidate_last_modified(self):
+        self.server.etag = False
+        HttpCache.fetch(self.url, self.log)
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: value\n')
+        self.assertEqual(self.server.requests[1].get('If-Modified-Since'), self.server.last_modified)
+
+    def test_changed_content(self):
+        HttpCache.fetch(self.url, self.log)
+        self.server.content = b'key: changed\n'
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: changed\n')
+
+        # The cache is updated, too
+        self.offline = True
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: changed\n')
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(RenderError):
+            HttpCache.get(self.url, self.log, sha256='0' * 64)
+
+        # Mismatching content is not cached
+        self.offline = True
+        with self.assertRaises(RenderError):
+            HttpCache.fetch(self.url, self.log)
+
+    def test_checksum_mismatch_cached(self):
+        HttpCache.fetch(self.url, self.log)
+        self.server.content = b'key: changed\n'
+        sha256 = hashlib.sha256(self.server.content).hexdigest()
+
+        # Cached content not matching the pin is downloaded again without revalidation
+        self.assertEqual(HttpCache.fetch(self.url, self.log, sha256=sha256), b'key: changed\n')
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+
+    def test_pinned(self):
+        sha256 = hashlib.sha256(self.server.content).hexdigest()
+        HttpCache.get(self.url, self.log, sha256=sha256)
+        self.assertEqual(HttpCache.fetch(self.url, self.log, sha256=sha256), b'key: value\n')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_offline(self):
+        HttpCache.fetch(self.url, self.log)
+        self.server.content = b'key: changed\n'
+        self.offline = True
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: value\n')
+        self.assertEqual(len(self.server.requests), 1)
+
+        with self.assertRaises(RenderError):
+            HttpCache.fetch(f'{self.url}.missing', self.log)
+
+    def test_server_down(self):
+        HttpCache.fetch(self.url, self.log)
+        self.stop_server()
+        self.assertEqual(HttpCache.fetch(self.url, self.log), b'key: value\n')
+
+        with self.assertRaises(RenderError):
+            HttpCache.fetch(f'{self.url}.missing', self.log)
+
+
+if __name__ == '__main__':
+    unittest.main()